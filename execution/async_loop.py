@@ -0,0 +1,43 @@
+"""
+Background Event Loop
+One persistent asyncio loop shared by all sessions for async API clients
+"""
+
+import asyncio
+import threading
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get or create the global background event loop.
+
+    Streamlit scripts run synchronously, so coroutines are submitted to this
+    loop from the script thread with asyncio.run_coroutine_threadsafe.
+    """
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever,
+                    name="async-loop",
+                    daemon=True
+                )
+                thread.start()
+                logger.info("✓ Background event loop started")
+                _loop = loop
+    return _loop
+
+
+def run_sync(coro, timeout: float = None):
+    """Run a coroutine on the background loop and wait for its result."""
+    future = asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+    return future.result(timeout)
@@ -5,6 +5,14 @@ Uses Streamlit's built-in audio recording capabilities
 
 import streamlit as st
 from io import BytesIO
+from pathlib import Path
+
+
+@st.cache_data(show_spinner=False)
+def _recorder_css() -> str:
+    """Load the recorder stylesheet once per process."""
+    css = Path(__file__).with_name("audio_recorder.css").read_text()
+    return f"<style>\n{css}</style>"
 
 
 def audio_recorder_component(key: str = "audio_recorder"):
@@ -18,16 +26,7 @@ def audio_recorder_component(key: str = "audio_recorder"):
         Audio bytes when recording is complete, None otherwise
     """
     
-    st.markdown("""
-    <style>
-    .stAudioInput {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        padding: 20px;
-        border-radius: 15px;
-        box-shadow: 0 8px 16px rgba(0,0,0,0.2);
-    }
-    </style>
-    """, unsafe_allow_html=True)
+    st.markdown(_recorder_css(), unsafe_allow_html=True)
     
     # Use Streamlit's built-in audio input
     audio_value = st.audio_input(
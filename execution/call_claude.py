@@ -4,47 +4,297 @@ Streaming wrapper for Anthropic API
 """
 
 import anthropic
+import asyncio
+import httpx
+import queue
+import random
 import streamlit as st
 import logging
+from execution.async_loop import get_event_loop
+from execution.http_clients import SSL_CONTEXT, POOL_LIMITS
 
 logger = logging.getLogger(__name__)
 
+# One long-lived HTTP/2 client for every ClaudeClient in the process, so
+# concurrent turns multiplex over a warm TLS connection
+_SHARED_HTTPX = httpx.AsyncClient(
+    http2=True,
+    verify=SSL_CONTEXT,
+    limits=POOL_LIMITS,
+    timeout=httpx.Timeout(connect=5.0, read=600.0, write=30.0, pool=5.0)
+)
+
+# Sentinel marking the end of a token stream in the hand-off queue
+_STREAM_END = object()
+
+# How often a waiting consumer checks that the producer is still alive
+_POLL_INTERVAL = 0.5
+
+
+async def _enqueue(q: queue.Queue, item):
+    """Put onto a bounded queue without ever blocking the event loop."""
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            await asyncio.sleep(0.01)
+
+
+def _next_item(q: queue.Queue, future, loop: asyncio.AbstractEventLoop):
+    """
+    Next item from the hand-off queue, never waiting on a dead producer.
+
+    If the producer finished without enqueueing a terminator (it was
+    cancelled, or the loop stopped), its outcome is returned instead.
+    """
+    while True:
+        try:
+            return q.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            if future.done():
+                break
+            if not loop.is_running():
+                return RuntimeError("Background event loop stopped during the Claude stream")
+
+    # The terminator may have landed just before the done check
+    try:
+        return q.get_nowait()
+    except queue.Empty:
+        pass
+    if future.cancelled():
+        return RuntimeError("Claude stream was cancelled")
+    error = future.exception()
+    if error is None:
+        return _STREAM_END
+    return error if isinstance(error, Exception) else RuntimeError(f"Claude stream stopped: {error!r}")
+
+
+def _retry_delay(error: anthropic.RateLimitError, attempt: int) -> float:
+    """Seconds to wait before retrying, honoring the server's retry-after hint."""
+    try:
+        delay = float(error.response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        delay = min(2 ** attempt, 30)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _system_blocks(system_prompt):
+    """
+    System prompt as content blocks, with a cache breakpoint on the text.
+
+    Plain strings are wrapped in one cached block; lists of blocks are
+    passed through as given.
+    """
+    if not system_prompt:
+        return ""
+    if isinstance(system_prompt, str):
+        return [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+    return system_prompt
+
 
 class ClaudeClient:
     """Wrapper for Claude API with streaming support."""
-    
+
     def __init__(self):
         """Initialize Anthropic client."""
-        self.client = anthropic.Anthropic(api_key=st.secrets["ANTHROPIC_API_KEY"])
+        self.client = anthropic.AsyncAnthropic(
+            api_key=st.secrets["ANTHROPIC_API_KEY"],
+            http_client=_SHARED_HTTPX
+        )
         self.model = st.secrets.get("CLAUDE_MODEL", "claude-sonnet-4-20250514")
+        # Small model for short classification calls (see aclassify)
+        self.fast_model = st.secrets.get("CLAUDE_FAST_MODEL", "claude-haiku-4-5")
         self.temperature = float(st.secrets.get("TEMPERATURE", "0.7"))
         self.max_tokens = int(st.secrets.get("MAX_TOKENS", "4096"))
-    
-    def chat_stream(self, messages: list, system_prompt: str = None):
+        self.max_retries = int(st.secrets.get("MAX_RETRIES", "3"))
+
+    def _open_stream(self, messages: list, system_prompt=None, model: str = None):
+        """Build the streaming request context manager."""
+        return self.client.messages.stream(
+            model=model or self.model,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            system=_system_blocks(system_prompt),
+            messages=messages
+        )
+
+    async def achat_stream(
+        self,
+        messages: list,
+        system_prompt: str = None,
+        model: str = None,
+        usage: dict = None
+    ):
         """
-        Stream chat completion from Claude.
-        
+        Stream chat completion from Claude without blocking the event loop.
+
         Args:
             messages: List of message dicts with 'role' and 'content'
-            system_prompt: Optional system prompt
-            
+            system_prompt: Optional system prompt, a string or a list of
+                content blocks; a string is sent as one cached block
+            model: Optional model override (defaults to CLAUDE_MODEL)
+            usage: Optional dict, filled with the response's token usage
+                (input_tokens, output_tokens, cache_creation_input_tokens,
+                cache_read_input_tokens) once the stream completes
+
         Yields:
             Text chunks from Claude's response
         """
+        for attempt in range(self.max_retries + 1):
+            received = False
+            try:
+                async with self._open_stream(messages, system_prompt, model) as stream:
+                    async for text in stream.text_stream:
+                        received = True
+                        yield text
+                    if usage is not None:
+                        # Counted by the API from message_start/message_delta
+                        final = (await stream.get_final_message()).usage
+                        usage.update(
+                            input_tokens=final.input_tokens,
+                            output_tokens=final.output_tokens,
+                            cache_creation_input_tokens=getattr(final, "cache_creation_input_tokens", None) or 0,
+                            cache_read_input_tokens=getattr(final, "cache_read_input_tokens", None) or 0
+                        )
+                return
+
+            except anthropic.RateLimitError as e:
+                # Only retry before any text went out, or the caller sees duplicates
+                if received or attempt == self.max_retries:
+                    logger.error(f"API error: {e}")
+                    raise
+                delay = _retry_delay(e, attempt)
+                logger.warning(f"Rate limited, retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+                await asyncio.sleep(delay)
+
+            except Exception as e:
+                logger.error(f"API error: {e}")
+                raise
+
+    async def _produce(
+        self,
+        q: queue.Queue,
+        messages: list,
+        system_prompt: str = None,
+        model: str = None,
+        usage: dict = None
+    ):
+        """Drain the async stream into the hand-off queue (runs on the loop)."""
         try:
-            with self.client.messages.stream(
-                model=self.model,
-                max_tokens=self.max_tokens,
-                temperature=self.temperature,
-                system=system_prompt if system_prompt else "",
-                messages=messages
-            ) as stream:
-                for text in stream.text_stream:
-                    yield text
-                    
+            async for text in self.achat_stream(messages, system_prompt, model, usage):
+                await _enqueue(q, text)
         except Exception as e:
-            logger.error(f"API error: {e}")
+            await _enqueue(q, e)
+            return
+        except BaseException as e:
+            # Cancelled: a waiting consumer also notices via the future, so
+            # the terminator is best effort and must not block
+            try:
+                q.put_nowait(RuntimeError(f"Claude stream stopped: {e!r}"))
+            except queue.Full:
+                pass
             raise
+        await _enqueue(q, _STREAM_END)
+
+    def chat_stream(
+        self,
+        messages: list,
+        system_prompt: str = None,
+        model: str = None,
+        usage: dict = None
+    ):
+        """
+        Synchronous bridge over achat_stream for Streamlit scripts.
+
+        The stream runs on the shared background event loop and feeds a
+        bounded queue, so network receive never waits on rendering. Tokens
+        that arrive while the caller is busy are coalesced into one chunk.
+        A usage dict, if given, is filled before the last chunk is yielded
+        (see achat_stream).
+
+        Yields:
+            Text chunks from Claude's response
+        """
+        q = queue.Queue(maxsize=64)
+        loop = get_event_loop()
+        future = asyncio.run_coroutine_threadsafe(
+            self._produce(q, messages, system_prompt, model, usage),
+            loop
+        )
+
+        try:
+            finished = False
+            while not finished:
+                chunks = [_next_item(q, future, loop)]
+                while True:
+                    try:
+                        chunks.append(q.get_nowait())
+                    except queue.Empty:
+                        break
+
+                last = chunks[-1]
+                if last is _STREAM_END or isinstance(last, Exception):
+                    chunks.pop()
+                    finished = True
+
+                if chunks:
+                    yield "".join(chunks)
+
+                if isinstance(last, Exception):
+                    raise last
+        finally:
+            # Stops the producer if the caller abandons the stream early
+            future.cancel()
+
+    async def aclassify(self, prompt: str, system_prompt: str = None, max_tokens: int = 30) -> str:
+        """
+        Short deterministic completion on the fast model, without streaming.
+
+        For YES/NO style checks: a few output tokens gain nothing from
+        streaming, and the small model answers them much sooner.
+
+        Returns:
+            The response text
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.client.messages.create(
+                    model=self.fast_model,
+                    max_tokens=max_tokens,
+                    temperature=0.0,
+                    system=system_prompt if system_prompt else "",
+                    messages=[{"role": "user", "content": prompt}]
+                )
+                return "".join(block.text for block in response.content if block.type == "text")
+
+            except anthropic.RateLimitError as e:
+                if attempt == self.max_retries:
+                    logger.error(f"API error: {e}")
+                    raise
+                delay = _retry_delay(e, attempt)
+                logger.warning(f"Rate limited, retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+                await asyncio.sleep(delay)
+
+            except Exception as e:
+                logger.error(f"API error: {e}")
+                raise
+
+    def classify_many(self, prompts: list, system_prompt: str = None, max_tokens: int = 30) -> list:
+        """
+        Run aclassify for every prompt concurrently on the shared event loop.
+
+        Returns:
+            One entry per prompt, in order: the response text, or the
+            exception that call raised
+        """
+        async def run():
+            return await asyncio.gather(
+                *(self.aclassify(prompt, system_prompt, max_tokens) for prompt in prompts),
+                return_exceptions=True
+            )
+
+        return asyncio.run_coroutine_threadsafe(run(), get_event_loop()).result()
 
 
 @st.cache_resource
@@ -4,15 +4,56 @@ Handles PostgreSQL connection pooling with proper lifecycle management
 """
 
 import psycopg2
-from psycopg2 import pool, extras
+from psycopg2 import pool, extras, extensions
 from contextlib import contextmanager
-from typing import Optional, List, Dict, Any
+import asyncio
+from typing import Optional, List, Dict, Any, Iterator
+import hashlib
+import itertools
 import logging
+import orjson
+import re
+import select
+import threading
+from uuid import uuid4
 import streamlit as st
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Decode json/jsonb columns (conversation metadata on every retrieved row)
+# with orjson instead of the stdlib parser
+extras.register_default_json(globally=True, loads=orjson.loads)
+extras.register_default_jsonb(globally=True, loads=orjson.loads)
+
+# Writes NOTIFY this channel so every process drops its cached SELECTs
+_CHANGES_CHANNEL = "mem_changes"
+
+# Supabase's transaction-mode pooler accepts LISTEN but never delivers
+# notifications, so a listener there can't be trusted to invalidate
+_TRANSACTION_POOLER_PORT = "6543"
+_LISTEN_RETRY_MAX = 60.0
+
+_PLACEHOLDER = re.compile(r"%s|%%")
+_SELECT = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+
+
+def vector_literal(values) -> str:
+    """
+    Format an embedding (list or ndarray) as a pgvector text literal.
+
+    orjson writes the '[x,y,...]' form in C instead of a Python str() per
+    element; psycopg2 only sends text parameters, so this is the wire format.
+    """
+    return orjson.dumps(values, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+
+class PooledConnection(extensions.connection):
+    """Pool connection that remembers which statements it has prepared."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
 
 class DatabaseManager:
     """
@@ -23,6 +64,20 @@ class DatabaseManager:
     def __init__(self):
         """Initialize database connection pool."""
         self._pool: Optional[pool.ThreadedConnectionPool] = None
+        self._listen_conn = None
+        self._stop_listening = threading.Event()
+        # Short TTL unless invalidations can actually arrive (see _start_listener)
+        self._select_cache = _short_cached_select
+        # Server-side prepared statements break behind transaction-mode poolers
+        # (Supabase port 6543), so they are opt-in for direct connections
+        self._use_prepared = str(st.secrets.get("DB_PREPARED_STATEMENTS", "false")).lower() == "true"
+        # Nearest-neighbour searches order by this column and cast. The
+        # half-precision copy (pgvector >= 0.7, added by migrate_database)
+        # halves the HNSW index and the bytes each probe reads.
+        if str(st.secrets.get("HALFVEC_EMBEDDINGS", "false")).lower() == "true":
+            self.ann_column, self.ann_type = "embedding_half", "halfvec"
+        else:
+            self.ann_column, self.ann_type = "embedding", "vector"
         self._initialize_pool()
     
     def _initialize_pool(self):
@@ -34,19 +89,96 @@ class DatabaseManager:
                 minconn=1,
                 maxconn=10,
                 dsn=db_url,
-                cursor_factory=extras.RealDictCursor
+                cursor_factory=extras.RealDictCursor,
+                connection_factory=PooledConnection
             )
             logger.info("✓ Database connection pool created")
         except Exception as e:
             logger.error(f"Failed to create connection pool: {e}")
             raise ConnectionError(f"Cannot connect to database: {e}")
+        
+        self._start_listener(st.secrets.get("DB_LISTEN_URL") or db_url)
+    
+    def _start_listener(self, dsn: str):
+        """
+        LISTEN for writes on a dedicated connection outside the pool.
+        
+        DB_LISTEN_URL can point this at a direct or session-mode connection
+        when SUPABASE_DB_URL is the transaction pooler. Cached reads only
+        get the long TTL when notifications can be delivered.
+        """
+        try:
+            port = str(extensions.parse_dsn(dsn).get("port", "5432"))
+        except psycopg2.ProgrammingError:
+            port = _TRANSACTION_POOLER_PORT
+        if port == _TRANSACTION_POOLER_PORT:
+            logger.warning(
+                "Cache invalidation needs a direct or session-mode DB_LISTEN_URL; "
+                "cached reads expire after 60s instead"
+            )
+            return
+        
+        self._select_cache = _cached_select
+        threading.Thread(
+            target=self._listen_forever,
+            args=(dsn,),
+            name="db-listen",
+            daemon=True
+        ).start()
+    
+    def _listen_forever(self, dsn: str):
+        """Keep a LISTEN connection open, reconnecting with backoff."""
+        delay = 1.0
+        while not self._stop_listening.is_set():
+            try:
+                conn = psycopg2.connect(dsn)
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {_CHANGES_CHANNEL}")
+                cursor.close()
+            except psycopg2.Error as e:
+                logger.warning("Cache invalidation listener unavailable, retrying in %.0fs: %s", delay, e)
+                self._stop_listening.wait(delay)
+                delay = min(delay * 2, _LISTEN_RETRY_MAX)
+                continue
+            
+            self._listen_conn = conn
+            delay = 1.0
+            # Writes made while disconnected were never announced
+            self._select_cache.clear()
+            logger.info("✓ Listening for cache invalidations")
+            
+            self._poll_notifies(conn)
+            if not conn.closed:
+                conn.close()
+    
+    def _poll_notifies(self, conn):
+        """Clear the SELECT cache whenever any process commits a write."""
+        while not conn.closed and not self._stop_listening.is_set():
+            try:
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+            except (psycopg2.Error, OSError, ValueError) as e:
+                if not self._stop_listening.is_set():
+                    logger.warning("Cache invalidation listener dropped, reconnecting: %s", e)
+                return
+            
+            if conn.notifies:
+                conn.notifies.clear()
+                self._select_cache.clear()
+    
+    def _notify_change(self, cursor):
+        """Queue a change notification, delivered when the write commits."""
+        cursor.execute(f"NOTIFY {_CHANGES_CHANNEL}")
     
     @contextmanager
-    def get_connection(self):
+    def get_connection(self, autocommit: bool = False):
         """
         Context manager for safe database connections.
         
-        Connection is automatically returned to pool when done.
+        Connection is automatically returned to pool when done. Read-only
+        callers pass autocommit=True so no COMMIT round trip is sent.
         """
         if self._pool is None:
             raise RuntimeError("Database pool not initialized")
@@ -54,15 +186,22 @@ class DatabaseManager:
         conn = None
         try:
             conn = self._pool.getconn()
+            if conn.autocommit != autocommit:
+                conn.autocommit = autocommit
             yield conn
-            conn.commit()  # CRITICAL: Commit before returning to pool
+            if not autocommit:
+                conn.commit()  # CRITICAL: Commit before returning to pool
             
         except psycopg2.Error as e:
-            if conn:
+            # Rolling back an idle session is a wasted round trip
+            if (
+                conn
+                and not conn.closed
+                and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE
+            ):
                 conn.rollback()
-            logger.error(f"Database error: {e}")
+            logger.error("Database error: %s", e)
             raise
-
             
         finally:
             if conn:
@@ -73,14 +212,104 @@ class DatabaseManager:
         query: str, 
         params: Optional[tuple] = None
     ) -> List[Dict[str, Any]]:
-        """Execute a SELECT query and return results."""
-        with self.get_connection() as conn:
+        """
+        Execute a SELECT query and return results.
+        
+        Identical reads are served from Streamlit's data cache. Writes
+        through this manager clear it here and, via NOTIFY, in every other
+        process; the TTL only bounds staleness from outside writers.
+        """
+        if _SELECT.match(query):
+            return self._select_cache(query, tuple(params) if params is not None else None)
+        return self._raw_select(query, params)
+    
+    def _raw_select(
+        self,
+        query: str,
+        params: Optional[tuple] = None
+    ) -> List[Dict[str, Any]]:
+        """Execute a read query against the database, bypassing the cache."""
+        with self.get_connection(autocommit=True) as conn:
             cursor = conn.cursor()
-            cursor.execute(query, params)
+            self._execute(conn, cursor, query, params)
             results = cursor.fetchall()
             cursor.close()
             return results
     
+    def clear_query_cache(self):
+        """Drop cached SELECT results after a write."""
+        self._select_cache.clear()
+    
+    def execute_query_fast(
+        self,
+        query: str,
+        params: Optional[tuple] = None
+    ) -> List[tuple]:
+        """
+        Execute a SELECT query and return namedtuple rows.
+        
+        For hot paths with a fixed column list: rows are flat tuples read by
+        attribute (row.id) instead of one dict allocated per row.
+        """
+        with self.get_connection(autocommit=True) as conn:
+            cursor = conn.cursor(cursor_factory=extras.NamedTupleCursor)
+            self._execute(conn, cursor, query, params)
+            results = cursor.fetchall()
+            cursor.close()
+            return results
+    
+    def stream_query(
+        self,
+        query: str,
+        params: Optional[tuple] = None,
+        chunk_size: int = 1000
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Execute a SELECT query through a server-side cursor and yield rows.
+        
+        Rows arrive chunk_size at a time, so memory stays bounded however
+        large the result. The pooled connection is held until the generator
+        is exhausted or closed.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor(name=f"stream_{uuid4().hex}")
+            cursor.itersize = chunk_size
+            cursor.execute(query, params)
+            for row in cursor:
+                yield row
+            cursor.close()
+    
+    def _prepare(self, conn: PooledConnection, cursor, query: str) -> str:
+        """PREPARE the query once per connection and return its statement name."""
+        name = "stmt_" + hashlib.md5(query.encode()).hexdigest()[:16]
+        if name not in conn.prepared:
+            position = itertools.count(1)
+            body = _PLACEHOLDER.sub(
+                lambda m: "%" if m.group() == "%%" else f"${next(position)}",
+                query
+            )
+            cursor.execute(f"PREPARE {name} AS {body}")
+            conn.prepared.add(name)
+        return name
+    
+    def _execute(self, conn: PooledConnection, cursor, query: str, params: Optional[tuple]):
+        """
+        Execute a statement, reusing a per-connection prepared plan if enabled.
+        
+        Postgres then parses and plans the retrieval and insert statements
+        once per pooled connection instead of on every call.
+        """
+        if not self._use_prepared:
+            cursor.execute(query, params)
+            return
+        
+        name = self._prepare(conn, cursor, query)
+        if params:
+            placeholders = ", ".join(["%s"] * len(params))
+            cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+        else:
+            cursor.execute(f"EXECUTE {name}")
+    
     def execute_insert(
         self,
         query: str,
@@ -89,38 +318,146 @@ class DatabaseManager:
         """Execute an INSERT query and return the new ID."""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute(query, params)
+            self._execute(conn, cursor, query, params)
             result = cursor.fetchone()
+            self._notify_change(cursor)
+            cursor.close()
+        self.clear_query_cache()
+        return result['id'] if result else None
+    
+    def execute_update(
+        self,
+        query: str,
+        params: Optional[tuple] = None
+    ) -> int:
+        """Execute an UPDATE/DELETE query and return the number of rows affected."""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            self._execute(conn, cursor, query, params)
+            rowcount = cursor.rowcount
+            self._notify_change(cursor)
+            cursor.close()
+        self.clear_query_cache()
+        return rowcount
+    
+    def execute_insert_many(
+        self,
+        query: str,
+        rows: List[tuple],
+        page_size: int = 500
+    ) -> List[str]:
+        """
+        Insert many rows in one round trip per page and return the new IDs.
+        
+        The query must use a single VALUES %s placeholder and RETURNING id,
+        e.g. "INSERT INTO t (a, b) VALUES %s RETURNING id".
+        """
+        if not rows:
+            return []
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            results = extras.execute_values(
+                cursor, query, rows, page_size=page_size, fetch=True
+            )
+            self._notify_change(cursor)
             cursor.close()
-            return result['id'] if result else None
+        self.clear_query_cache()
+        return [row['id'] for row in results]
+    
+    def execute_batch(
+        self,
+        query: str,
+        rows: List[tuple],
+        page_size: int = 100
+    ):
+        """
+        Run a parameterized write once per row, page_size rows per round trip.
+        
+        For UPDATE/DELETE statements that use the usual %s placeholders.
+        """
+        if not rows:
+            return
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            extras.execute_batch(cursor, query, rows, page_size=page_size)
+            self._notify_change(cursor)
+            cursor.close()
+        self.clear_query_cache()
+    
+    async def aexecute_query(
+        self,
+        query: str,
+        params: Optional[tuple] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Async execute_query for event-loop callers.
+        
+        The blocking round trip runs in a worker thread against the same pool,
+        so the loop keeps serving other coroutines while Postgres answers.
+        """
+        return await asyncio.to_thread(self.execute_query, query, params)
+    
+    async def aexecute_insert(
+        self,
+        query: str,
+        params: tuple
+    ) -> Optional[str]:
+        """Async execute_insert (see aexecute_query)."""
+        return await asyncio.to_thread(self.execute_insert, query, params)
     
     def test_connection(self) -> bool:
         """Test if database connection is working."""
         try:
-            with self.get_connection() as conn:
+            with self.get_connection(autocommit=True) as conn:
                 cursor = conn.cursor()
                 cursor.execute("SELECT 1")
                 result = cursor.fetchone()
                 cursor.close()
                 return result is not None
         except Exception as e:
-            logger.error(f"Connection test failed: {e}")
+            logger.error("Connection test failed: %s", e)
             return False
     
     def close_pool(self):
         """Close all connections in the pool."""
+        self._stop_listening.set()
+        if self._listen_conn and not self._listen_conn.closed:
+            self._listen_conn.close()
         if self._pool:
             self._pool.closeall()
             logger.info("✓ Database connection pool closed")
 
 
-# CRITICAL: Global database manager with caching
-@st.cache_resource
-def get_db_manager():
+@st.cache_data(ttl=300, max_entries=256, show_spinner=False)
+def _cached_select(query: str, params: Optional[tuple]) -> List[Dict[str, Any]]:
+    """Memoized read keyed on (query, params), invalidated by NOTIFY."""
+    return get_db_manager()._raw_select(query, params)
+
+
+@st.cache_data(ttl=60, max_entries=256, show_spinner=False)
+def _short_cached_select(query: str, params: Optional[tuple]) -> List[Dict[str, Any]]:
+    """Memoized read for when no listener can invalidate it."""
+    return get_db_manager()._raw_select(query, params)
+
+
+# CRITICAL: Exactly one pool per process. A plain double-checked singleton
+# avoids walking Streamlit's cache machinery on every query.
+_db_manager: Optional[DatabaseManager] = None
+_db_manager_lock = threading.Lock()
+
+
+def get_db_manager() -> DatabaseManager:
     """
     Get or create the global database manager instance.
-    Cached by Streamlit so only one pool exists per session.
     
-    THIS DECORATOR IS CRITICAL - Without it, connections fail.
+    Only one pool may exist per process - creating one per call exhausts
+    database connections.
     """
-    return DatabaseManager()
+    global _db_manager
+    if _db_manager is None:
+        with _db_manager_lock:
+            if _db_manager is None:
+                _db_manager = DatabaseManager()
+    return _db_manager
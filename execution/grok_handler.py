@@ -5,69 +5,418 @@ Handles real-time market data queries via Grok
 
 import streamlit as st
 import openai
+import httpx
+import asyncio
+import hashlib
 import logging
-from typing import Optional, Dict, Any
+import numpy as np
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional, Dict, Any, Iterator, NamedTuple, Tuple
+from execution.async_loop import get_event_loop
+from execution.http_clients import SSL_CONTEXT, POOL_LIMITS
+from execution.local_embeddings import get_embeddings
 
 logger = logging.getLogger(__name__)
 
+# Stable system prefix so xAI's automatic prompt caching can reuse it
+GROK_SYSTEM_PROMPT = (
+    "You are Grok, providing real-time market data and current information. "
+    "Be concise and factual. Include current prices, dates, and sources when relevant."
+)
+
+# Long-lived HTTP/2 clients reused by every GrokClient for connection reuse
+_GROK_TIMEOUT = httpx.Timeout(connect=5.0, read=60.0, write=30.0, pool=5.0)
+_SHARED_HTTPX = httpx.Client(
+    http2=True,
+    verify=SSL_CONTEXT,
+    limits=POOL_LIMITS,
+    timeout=_GROK_TIMEOUT
+)
+_SHARED_ASYNC_HTTPX = httpx.AsyncClient(
+    http2=True,
+    verify=SSL_CONTEXT,
+    limits=POOL_LIMITS,
+    timeout=_GROK_TIMEOUT
+)
+
+# Response cache. Prices and "right now" answers go stale within a minute;
+# anything else is reused for an hour.
+_CACHE_MAX_ENTRIES = 256
+_VOLATILE_TTL = 60.0
+_DEFAULT_TTL = 3600.0
+# Embeddings are normalized, so the dot product is the cosine similarity
+_SEMANTIC_THRESHOLD = 0.97
+# Prompts naming different things ("AAPL" vs "AMD", "Q3" vs "Q4") embed
+# almost identically, so a semantic hit also needs the same entity tokens
+_ENTITY_WORD = re.compile(r"[A-Za-z][\w&-]*|\d[\d.,%]*")
+_CRYPTO_SYMBOLS = frozenset({
+    "btc", "bitcoin", "eth", "ethereum", "sol", "solana", "xrp", "doge",
+    "dogecoin", "ada", "bnb", "usdt", "usdc"
+})
+
+
+class GrokResult(NamedTuple):
+    """One Grok answer with its token usage; error is set on failure."""
+    text: str = ""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    error: Optional[str] = None
+    cached: bool = False
+
+
+def _compile_triggers(triggers) -> re.Pattern:
+    """
+    Compile lowercase trigger phrases into one substring matcher.
+
+    Any trigger containing a shorter trigger can never change the answer
+    ("stock price" always contains "price"), so those are pruned. The rest
+    are folded into a prefix trie so the regex engine tests shared prefixes
+    once per position instead of once per phrase.
+    """
+    minimal = [
+        t for t in dict.fromkeys(triggers)
+        if not any(other != t and other in t for other in triggers)
+    ]
+
+    trie = {}
+    for phrase in minimal:
+        node = trie
+        for ch in phrase:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node) -> str:
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return re.compile(build(trie))
+
 
 class GrokClient:
     """Wrapper for XAI Grok API with smart query routing."""
+
+    # Explicit Grok routing - user forces it
+    EXPLICIT_TRIGGERS = (
+        "grok", "ask grok", "use grok", "real-time", "realtime",
+        "real time", "live data", "look up", "search for"
+    )
+
+    # Real-time/current data triggers
+    TIME_TRIGGERS = (
+        "current", "currently", "latest", "today", "right now",
+        "now", "recent", "recently", "this week", "this month",
+        "breaking", "up to date", "up-to-date", "as of"
+    )
+
+    # Financial data triggers
+    FINANCIAL_TRIGGERS = (
+        "price", "stock price", "stock", "market cap", "trading at",
+        "earnings", "dividend", "p/e", "pe ratio", "share price",
+        "volume", "market", "ticker", "crypto", "bitcoin", "btc",
+        "eth", "ethereum", "forex", "exchange rate", "s&p",
+        "nasdaq", "dow jones", "index"
+    )
+
+    # News triggers
+    NEWS_TRIGGERS = (
+        "news", "announcement", "announced", "reported",
+        "earnings report", "press release", "headline",
+        "what happened", "what's happening", "update on"
+    )
+
+    # Weather / sports / live events
+    LIVE_TRIGGERS = (
+        "weather", "forecast", "score", "game", "match",
+        "election", "results"
+    )
+
+    # Well-known symbols, matched only when written in capitals so "meta" or
+    # "snow" in ordinary prose don't route. Symbols that are also common
+    # capitalized words (V, MA, CAT, ALL, IT...) are left out.
+    TICKERS = frozenset({
+        "AAPL", "MSFT", "NVDA", "GOOGL", "GOOG", "AMZN", "META", "TSLA",
+        "AVGO", "AMD", "INTC", "NFLX", "ORCL", "CRM", "ADBE", "PLTR",
+        "COIN", "MSTR", "HOOD", "JPM", "GS", "BAC", "WFC", "PYPL",
+        "XOM", "CVX", "JNJ", "PFE", "LLY", "UNH", "WMT", "PEP", "NKE",
+        "SBUX", "UBER", "ABNB", "SHOP", "SNOW", "TSM", "ASML", "BABA",
+        "SPY", "QQQ", "IWM", "DIA", "VOO", "VTI",
+        "SOL", "XRP", "DOGE", "ADA", "BNB", "USDT", "USDC"
+    })
+
+    ALL_TRIGGERS = (
+        EXPLICIT_TRIGGERS + TIME_TRIGGERS + FINANCIAL_TRIGGERS
+        + NEWS_TRIGGERS + LIVE_TRIGGERS
+    )
+
+    # Compiled once at import, so routing is a single C-level scan
+    # instead of a Python loop of substring checks per trigger
+    _trigger_pattern = _compile_triggers(ALL_TRIGGERS)
+    _volatile_pattern = _compile_triggers(TIME_TRIGGERS + FINANCIAL_TRIGGERS)
+    _ticker_token = re.compile(r"\b[A-Z]{2,5}\b")
+
+    _system_message = {"role": "system", "content": GROK_SYSTEM_PROMPT}
     
     def __init__(self):
         """Initialize XAI client."""
         try:
+            api_key = st.secrets["XAI_API_KEY"]
+            # The SDK retries 429/5xx, timeouts and dropped connections with
+            # jittered exponential backoff, honoring retry-after
+            max_retries = int(st.secrets.get("MAX_RETRIES", "3"))
             self.client = openai.OpenAI(
-                api_key=st.secrets["XAI_API_KEY"],
-                base_url="https://api.x.ai/v1"
+                api_key=api_key,
+                base_url="https://api.x.ai/v1",
+                http_client=_SHARED_HTTPX,
+                max_retries=max_retries
+            )
+            self.aclient = openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url="https://api.x.ai/v1",
+                http_client=_SHARED_ASYNC_HTTPX,
+                max_retries=max_retries
             )
             self.model = "grok-4-1-fast"
+            # key -> (expires_at, max_tokens, embedding, entities, result), LRU order
+            self._cache: "OrderedDict[str, Tuple[float, int, Optional[np.ndarray], frozenset, GrokResult]]" = OrderedDict()
+            self._cache_lock = threading.Lock()
+            self.stats = {"hits": 0, "semantic_hits": 0, "misses": 0}
             logger.info("✓ Grok client initialized")
         except Exception as e:
             logger.error(f"Failed to initialize Grok client: {e}")
             raise
     
-    def query_grok(self, prompt: str, max_tokens: int = 500) -> Optional[Dict[str, Any]]:
+    def _request(self, prompt: str, max_tokens: int) -> Dict[str, Any]:
+        """Chat completion arguments shared by the sync and async paths."""
+        return {
+            "model": self.model,
+            "messages": [
+                self._system_message,
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": max_tokens,
+            "temperature": 0.3  # Lower for factual responses
+        }
+    
+    def _to_result(self, text: str, usage) -> GrokResult:
+        """Pair response text with token usage, and queue the usage record."""
+        result = GrokResult(
+            text,
+            usage.prompt_tokens,
+            usage.completion_tokens,
+            usage.total_tokens
+        )
+        
+        _TELEMETRY_Q.put_nowait({
+            "model": self.model,
+            "prompt_tokens": result.prompt_tokens,
+            "completion_tokens": result.completion_tokens,
+            "total_tokens": result.total_tokens,
+            "ts": time.time()
+        })
+        return result
+    
+    def _embed(self, prompt: str) -> Optional[np.ndarray]:
+        """Embed a normalized prompt for the semantic cache, if the model loads."""
+        try:
+            return np.asarray(get_embeddings().embed_query(prompt), dtype=np.float32)
+        except Exception as e:
+            logger.warning("Semantic cache disabled for this query: %s", e)
+            return None
+    
+    def _entities(self, prompt: str) -> frozenset:
+        """
+        Tokens naming what a prompt is about: numbers, symbols and names.
+
+        Known tickers and coins count in any case; other words count when
+        capitalized past the first word (so "What's" doesn't, "Nvidia" does).
+        """
+        entities = set()
+        for i, word in enumerate(_ENTITY_WORD.findall(prompt)):
+            lower = word.lower()
+            if (
+                word[0].isdigit()
+                or word.upper() in self.TICKERS
+                or lower in _CRYPTO_SYMBOLS
+                or (word.isupper() and len(word) > 1)
+                or (i > 0 and word[0].isupper())
+            ):
+                entities.add(lower)
+        return frozenset(entities)
+    
+    def _cache_get(
+        self, prompt: str, max_tokens: int
+    ) -> Tuple[str, str, Optional[np.ndarray], Optional[GrokResult]]:
+        """
+        Look a prompt up in the response cache.
+        
+        Exact matches on the normalized prompt are tried first, then
+        near-duplicates by embedding similarity that name the same
+        entities (see _entities).
+        
+        Returns:
+            (key, normalized prompt, embedding, cached result or None)
+        """
+        normalized = " ".join(prompt.lower().split())
+        key = hashlib.sha256(f"{self.model}|{normalized}|{max_tokens}".encode()).hexdigest()
+        now = time.monotonic()
+        
+        with self._cache_lock:
+            for stale in [k for k, entry in self._cache.items() if entry[0] <= now]:
+                del self._cache[stale]
+            
+            entry = self._cache.get(key)
+            if entry:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                logger.info("Grok cache hit (exact), stats=%s", self.stats)
+                return key, normalized, None, entry[4]._replace(cached=True)
+        
+        embedding = self._embed(normalized)
+        if embedding is None:
+            with self._cache_lock:
+                self.stats["misses"] += 1
+            return key, normalized, None, None
+        
+        entities = self._entities(prompt)
+        with self._cache_lock:
+            candidates = [
+                (k, entry) for k, entry in self._cache.items()
+                if entry[1] == max_tokens and entry[2] is not None and entry[3] == entities
+            ]
+            if candidates:
+                similarities = np.stack([entry[2] for _, entry in candidates]) @ embedding
+                best = int(np.argmax(similarities))
+                if similarities[best] >= _SEMANTIC_THRESHOLD:
+                    best_key, best_entry = candidates[best]
+                    self._cache.move_to_end(best_key)
+                    self.stats["semantic_hits"] += 1
+                    logger.info(
+                        "Grok cache hit (similarity %.3f), stats=%s",
+                        similarities[best], self.stats
+                    )
+                    return key, normalized, embedding, best_entry[4]._replace(cached=True)
+            
+            self.stats["misses"] += 1
+        return key, normalized, embedding, None
+    
+    def _cache_put(
+        self,
+        key: str,
+        prompt: str,
+        normalized: str,
+        max_tokens: int,
+        embedding: Optional[np.ndarray],
+        result: GrokResult
+    ):
+        """Store a successful response; errors are never cached."""
+        ttl = _VOLATILE_TTL if self._volatile_pattern.search(normalized) else _DEFAULT_TTL
+        with self._cache_lock:
+            self._cache[key] = (time.monotonic() + ttl, max_tokens, embedding, self._entities(prompt), result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > _CACHE_MAX_ENTRIES:
+                self._cache.popitem(last=False)
+    
+    def query_grok(self, prompt: str, max_tokens: int = 500) -> GrokResult:
         """
         Send query to Grok and get real-time response.
         
+        Repeated and near-duplicate prompts are answered from a short-lived
+        cache; those results have cached=True.
+        
         Args:
             prompt: User query
             max_tokens: Maximum tokens in response
             
         Returns:
-            Dict with response text and token usage, or None on error
+            GrokResult with text and token usage, or with error set
         """
+        key, normalized, embedding, cached = self._cache_get(prompt, max_tokens)
+        if cached:
+            return cached
+        
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are Grok, providing real-time market data and current information. Be concise and factual. Include current prices, dates, and sources when relevant."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                max_tokens=max_tokens,
-                temperature=0.3  # Lower for factual responses
-            )
+            response = self.client.chat.completions.create(**self._request(prompt, max_tokens))
+            result = self._to_result(response.choices[0].message.content, response.usage)
             
-            result = {
-                "text": response.choices[0].message.content,
-                "prompt_tokens": response.usage.prompt_tokens,
-                "completion_tokens": response.usage.completion_tokens,
-                "total_tokens": response.usage.total_tokens
-            }
+        except Exception as e:
+            logger.error("Grok API error: %s", e, exc_info=True)
+            return GrokResult(error=str(e))
+        
+        self._cache_put(key, prompt, normalized, max_tokens, embedding, result)
+        return result
+    
+    async def aquery_grok(self, prompt: str, max_tokens: int = 500) -> GrokResult:
+        """
+        Async query_grok, so callers can gather Grok with other API calls.
+        
+        Returns:
+            GrokResult with text and token usage, or with error set
+        """
+        # The cache lookup embeds the prompt, which is CPU work
+        key, normalized, embedding, cached = await asyncio.to_thread(
+            self._cache_get, prompt, max_tokens
+        )
+        if cached:
+            return cached
+        
+        try:
+            response = await self.aclient.chat.completions.create(**self._request(prompt, max_tokens))
+            result = self._to_result(response.choices[0].message.content, response.usage)
             
-            logger.info(f"✓ Grok query successful: {result['total_tokens']} tokens")
-            return result
+        except Exception as e:
+            logger.error("Grok API error: %s", e, exc_info=True)
+            return GrokResult(error=str(e))
+        
+        self._cache_put(key, prompt, normalized, max_tokens, embedding, result)
+        return result
+    
+    def stream_grok(self, prompt: str, max_tokens: int = 500) -> Iterator[str]:
+        """
+        Stream a Grok answer as text deltas, for display as it arrives.
+        
+        Usage comes from the final chunk, so telemetry and the response
+        cache record the same result query_grok would. Unlike query_grok,
+        API errors are raised to the caller.
+        
+        Yields:
+            Text chunks from Grok's response
+        """
+        key, normalized, embedding, cached = self._cache_get(prompt, max_tokens)
+        if cached:
+            yield cached.text
+            return
+        
+        parts = []
+        usage = None
+        try:
+            stream = self.client.chat.completions.create(
+                **self._request(prompt, max_tokens),
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield parts[-1]
             
         except Exception as e:
-            logger.error(f"Grok API error: {e}", exc_info=True)
-            return {"error": str(e)}
+            logger.error("Grok API error: %s", e, exc_info=True)
+            raise
+        
+        if usage:
+            result = self._to_result("".join(parts), usage)
+            self._cache_put(key, prompt, normalized, max_tokens, embedding, result)
     
     def should_use_grok(self, query: str) -> bool:
         """
@@ -81,55 +430,24 @@ class GrokClient:
         """
         query_lower = query.lower().strip()
 
-        # Explicit Grok routing - user forces it
-        explicit_triggers = [
-            "grok", "ask grok", "use grok", "real-time", "realtime",
-            "real time", "live data", "look up", "search for"
-        ]
-
-        # Real-time/current data triggers
-        time_triggers = [
-            "current", "currently", "latest", "today", "right now",
-            "now", "recent", "recently", "this week", "this month",
-            "breaking", "up to date", "up-to-date", "as of"
-        ]
-
-        # Financial data triggers
-        financial_triggers = [
-            "price", "stock price", "stock", "market cap", "trading at",
-            "earnings", "dividend", "p/e", "pe ratio", "share price",
-            "volume", "market", "ticker", "crypto", "bitcoin", "btc",
-            "eth", "ethereum", "forex", "exchange rate", "s&p",
-            "nasdaq", "dow jones", "index"
-        ]
-
-        # News triggers
-        news_triggers = [
-            "news", "announcement", "announced", "reported",
-            "earnings report", "press release", "headline",
-            "what happened", "what's happening", "update on"
-        ]
-
-        # Weather / sports / live events
-        live_triggers = [
-            "weather", "forecast", "score", "game", "match",
-            "election", "results"
-        ]
-
-        all_triggers = (
-            explicit_triggers + time_triggers + financial_triggers
-            + news_triggers + live_triggers
-        )
+        # Lowercasing once is far cheaper than an IGNORECASE scan
+        match = self._trigger_pattern.search(query_lower)
+        if match:
+            logger.info("Grok trigger detected: '%s' in query: %.80s", match.group(0), query_lower)
+            return True
 
-        for trigger in all_triggers:
-            if trigger in query_lower:
-                logger.info(f"Grok trigger detected: '{trigger}' in query: {query_lower[:80]}")
-                return True
+        # Capitalized symbols are checked against the known set, so acronyms
+        # like NASA or HTTP don't trigger a paid lookup
+        tickers = self.TICKERS.intersection(self._ticker_token.findall(query))
+        if tickers:
+            logger.info("Grok ticker detected: %s in query: %.80s", sorted(tickers), query_lower)
+            return True
 
-        logger.debug(f"No Grok trigger matched for: {query_lower[:80]}")
+        logger.debug("No Grok trigger matched for: %.80s", query_lower)
         return False
     
-    def estimate_cost(self, tokens: int) -> float:
+    @staticmethod
+    def estimate_cost(tokens: int) -> float:
         """
         Estimate cost for Grok API usage.
         
@@ -144,28 +462,44 @@ class GrokClient:
         return cost
 
 
+# Usage records are logged by a daemon thread, off the response path
+_TELEMETRY_Q: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+
+
+def _drain_telemetry():
+    """Log Grok usage records as they arrive."""
+    while True:
+        record = _TELEMETRY_Q.get()
+        logger.info(
+            "✓ Grok query successful: %d tokens (%d prompt / %d completion), cost $%.4f",
+            record["total_tokens"],
+            record["prompt_tokens"],
+            record["completion_tokens"],
+            GrokClient.estimate_cost(record["total_tokens"])
+        )
+
+
+threading.Thread(target=_drain_telemetry, name="grok-telemetry", daemon=True).start()
+
+
 @st.cache_resource
 def get_grok_client():
     """Get or create the global Grok client instance."""
     return GrokClient()
 
 
-def hybrid_query(user_query: str, athena_context: str = "") -> Dict[str, Any]:
+def _route(user_query: str) -> Tuple[Optional[GrokClient], Optional[Dict[str, Any]]]:
     """
-    Execute hybrid query using both Grok and Claude.
-
-    Args:
-        user_query: User's question
-        athena_context: Relevant context from Athena's memory
+    Decide whether a query goes to Grok.
 
     Returns:
-        Dict with grok_data, should_synthesize flag, and metadata
+        (client, None) when Grok should be queried, else (None, final result)
     """
     try:
         grok = get_grok_client()
     except Exception as e:
         logger.error(f"Grok client unavailable: {e}")
-        return {
+        return None, {
             "use_grok": False,
             "grok_data": None,
             "cost": 0.0,
@@ -174,36 +508,84 @@ def hybrid_query(user_query: str, athena_context: str = "") -> Dict[str, Any]:
 
     # Check if we should use Grok
     should_use = grok.should_use_grok(user_query)
-    logger.info(f"should_use_grok('{user_query[:60]}') = {should_use}")
+    logger.info("should_use_grok('%.60s') = %s", user_query, should_use)
 
     if not should_use:
-        return {
+        return None, {
             "use_grok": False,
             "grok_data": None,
             "cost": 0.0
         }
 
-    # Query Grok for real-time data
     logger.info("Routing query to Grok for real-time data...")
-    grok_response = grok.query_grok(user_query)
+    return grok, None
 
-    if not grok_response or "error" in grok_response:
-        api_error = grok_response.get("error", "Unknown") if isinstance(grok_response, dict) else "No response"
-        logger.warning(f"Grok query FAILED — {api_error}")
+
+def _hybrid_result(grok: GrokClient, grok_response: GrokResult) -> Dict[str, Any]:
+    """Shape a Grok response (or failure) into the hybrid_query result."""
+    if grok_response.error is not None:
+        logger.warning("Grok query FAILED — %s", grok_response.error)
         return {
             "use_grok": False,
             "grok_data": None,
             "cost": 0.0,
-            "error": f"Grok API: {api_error}"
+            "error": f"Grok API: {grok_response.error}"
         }
 
-    # Calculate cost
-    cost = grok.estimate_cost(grok_response["total_tokens"])
+    # Calculate cost (cached answers cost nothing)
+    cost = 0.0 if grok_response.cached else grok.estimate_cost(grok_response.total_tokens)
 
-    logger.info(f"✓ Grok returned {grok_response['total_tokens']} tokens, cost ${cost:.4f}")
     return {
         "use_grok": True,
-        "grok_data": grok_response["text"],
-        "tokens": grok_response["total_tokens"],
+        "grok_data": grok_response.text,
+        "tokens": grok_response.total_tokens,
         "cost": cost
     }
+
+
+def hybrid_query(user_query: str, athena_context: str = "") -> Dict[str, Any]:
+    """
+    Execute hybrid query using both Grok and Claude.
+
+    Args:
+        user_query: User's question
+        athena_context: Relevant context from Athena's memory
+
+    Returns:
+        Dict with grok_data, should_synthesize flag, and metadata
+    """
+    grok, result = _route(user_query)
+    if grok is None:
+        return result
+
+    # Query Grok for real-time data
+    return _hybrid_result(grok, grok.query_grok(user_query))
+
+
+async def ahybrid_query(user_query: str, athena_context: str = "") -> Dict[str, Any]:
+    """
+    Async hybrid_query for event-loop callers.
+
+    Await it alongside other coroutines (e.g. with asyncio.gather) to
+    overlap the Grok round trip with other I/O.
+    """
+    grok, result = _route(user_query)
+    if grok is None:
+        return result
+
+    return _hybrid_result(grok, await grok.aquery_grok(user_query))
+
+
+def submit_hybrid_query(user_query: str, athena_context: str = "") -> Future:
+    """
+    Start ahybrid_query on the shared event loop and return its future.
+
+    Lets the caller search memories while Grok is in flight; call
+    .result() once the real-time data is actually needed. Concurrent
+    sessions share the loop and the async HTTP/2 client instead of each
+    tying up a worker thread for the whole round trip.
+    """
+    return asyncio.run_coroutine_threadsafe(
+        ahybrid_query(user_query, athena_context),
+        get_event_loop()
+    )
@@ -0,0 +1,13 @@
+"""
+Shared HTTP Settings
+One TLS context and connection-pool policy for every API client in the process
+"""
+
+import ssl
+import certifi
+import httpx
+
+# Loading the CA bundle costs ~10 ms of disk I/O, so build the context once
+SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
+
+POOL_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=40)
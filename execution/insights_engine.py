@@ -4,16 +4,37 @@ Generates weekly digests, detects contradictions, identifies patterns
 """
 
 import streamlit as st
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+import hashlib
 import logging
 import json
-from execution.db_manager import get_db_manager
+import threading
+import time
+from execution.db_manager import get_db_manager, vector_literal
 from execution.call_claude import get_claude_client
 from execution.local_embeddings import get_embeddings
 
 logger = logging.getLogger(__name__)
 
+# Contradiction verdicts for recently checked messages, reused only for the
+# exact same text: paraphrases with opposite stances ("bullish"/"bearish")
+# embed almost identically, so near-duplicates must be checked afresh.
+# Only conversations older than 30 days are compared, a window that moves
+# daily, so verdicts expire after a day.
+_CONTRADICTION_CACHE_SIZE = 256
+_CONTRADICTION_CACHE_TTL = 86400.0
+
+# Contradiction candidates: top-N from each of vector and keyword search,
+# merged with this weight on cosine similarity (the rest on keyword rank)
+_CANDIDATES_PER_SEARCH = 20
+_HYBRID_ALPHA = 0.5
+
+# Messages too short to state a view ("ok", "thanks", "go on") are never
+# checked for contradictions
+_CONTRADICTION_MIN_WORDS = 4
+
 
 class InsightsEngine:
     """Generates proactive insights from conversation history."""
@@ -22,6 +43,9 @@ class InsightsEngine:
         self.db = get_db_manager()
         self.claude = get_claude_client()
         self.embeddings = get_embeddings()
+        # message digest -> (expires, (past conversation, explanation, alerted conversation ids) or None)
+        self._verdicts: "OrderedDict[str, Tuple[float, Optional[tuple]]]" = OrderedDict()
+        self._verdicts_lock = threading.Lock()
     
     def should_generate_weekly_digest(self) -> bool:
         """
@@ -70,27 +94,21 @@ class InsightsEngine:
             # Get conversations from past 7 days
             week_ago = datetime.now() - timedelta(days=7)
             
-            query = """
-            SELECT id, title, full_transcript, metadata, created_at
-            FROM conversations
-            WHERE created_at >= %s
-            ORDER BY created_at DESC
-            """
-            
-            conversations = self.db.execute_query(query, (week_ago.isoformat(),))
+            # Count, topics and patterns in one round trip
+            week = self._summarize_week(week_ago)
+            conversation_count = week["conversation_count"]
             
-            if not conversations:
+            if not conversation_count:
                 logger.info("No conversations in past week, skipping digest")
                 return None
             
-            # Extract topics and patterns
-            topics = self._extract_topics(conversations)
-            patterns = self._identify_patterns(conversations)
+            topics = week["topics"]
+            patterns = week["patterns"]
             
             # Generate digest using Claude
             digest_prompt = f"""Analyze these conversation patterns from the past week and create a concise weekly digest.
 
-CONVERSATION COUNT: {len(conversations)}
+CONVERSATION COUNT: {conversation_count}
 
 TOP TOPICS:
 {json.dumps(topics, indent=2)}
@@ -127,13 +145,19 @@ Be concise, insightful, and investor-focused. Format in clear sections."""
             
             digest_id = self.db.execute_insert(
                 save_query,
-                (week_start, week_end, len(conversations), topics, digest_text)
+                (week_start, week_end, conversation_count, topics, digest_text)
             )
             
             logger.info(f"✓ Weekly digest generated: {digest_id}")
             
-            # Send email if configured
-            self._send_digest_email(digest_text, week_start, week_end)
+            # Send email if configured, off this thread: SMTP handshake and
+            # login take seconds and the digest is already saved
+            threading.Thread(
+                target=self._send_digest_email,
+                args=(digest_text, week_start, week_end),
+                name="digest-email",
+                daemon=True
+            ).start()
             
             return digest_id
             
@@ -157,37 +181,54 @@ Be concise, insightful, and investor-focused. Format in clear sections."""
         Returns:
             Contradiction alert dict if found, None otherwise
         """
+        # Acknowledgements and one-word replies can't contradict anything;
+        # skip them before any embedding, query or Claude call
+        if len(new_message.split()) < _CONTRADICTION_MIN_WORDS:
+            return None
+        
         try:
+            # A recently checked message gets the same verdict without the
+            # embedding, search or Claude comparisons. A contradiction is
+            # still saved once for each conversation it comes up in.
+            key = hashlib.sha256(new_message.encode()).hexdigest()
+            found, verdict = self._cached_verdict(key)
+            if found:
+                if verdict is None:
+                    return None
+                past_conv, explanation, alerted = verdict
+                alert = self._contradiction_alert(
+                    new_message, current_conversation_id, past_conv, explanation
+                )
+                with self._verdicts_lock:
+                    first_here = current_conversation_id not in alerted
+                    alerted.add(current_conversation_id)
+                if first_here:
+                    self._save_alert(alert)
+                return alert
+            
             # Generate embedding for new message
             message_embedding = self.embeddings.embed_query(new_message)
-            embedding_str = '[' + ','.join(str(float(x)) for x in message_embedding) + ']'
             
             # Find similar past conversations (exclude last 30 days to avoid rapid iteration)
             thirty_days_ago = datetime.now() - timedelta(days=30)
             
-            query = """
-            SELECT 
-                id, title, full_transcript, created_at,
-                1 - (embedding <=> %s::vector) AS similarity
-            FROM conversations
-            WHERE created_at < %s
-            AND id::text != %s
-            ORDER BY similarity DESC
-            LIMIT 5
-            """
-            
-            similar_convs = self.db.execute_query(
-                query,
-                (embedding_str, thirty_days_ago.isoformat(), current_conversation_id)
+            similar_convs = self._similar_conversations(
+                new_message,
+                vector_literal(message_embedding),
+                thirty_days_ago,
+                current_conversation_id
             )
             
-            if not similar_convs or similar_convs[0]['similarity'] < 0.7:
+            if not similar_convs or max(c['similarity'] for c in similar_convs) < 0.7:
                 # No sufficiently similar past conversations
+                self._store_verdict(key, None)
                 return None
             
-            # Check for contradictions using Claude
-            for past_conv in similar_convs[:3]:  # Check top 3 most similar
-                contradiction_check = f"""Compare these two statements for CLEAR contradictions only:
+            # Check for contradictions using Claude: the top 3 most similar
+            # are compared concurrently, and the closest contradiction wins
+            candidates = similar_convs[:3]
+            prompts = [
+                f"""Compare these two statements for CLEAR contradictions only:
 
 CURRENT (Today): "{new_message}"
 
@@ -198,38 +239,159 @@ Are these CLEARLY contradictory? Only flag if they express opposite views on the
 Respond ONLY with:
 - "YES: [brief explanation]" if clearly contradictory
 - "NO" if not contradictory or just nuanced differences"""
-
-                response = ""
-                for chunk in self.claude.chat_stream(
-                    messages=[{"role": "user", "content": contradiction_check}],
-                    system_prompt="You detect clear contradictions. Be conservative - only flag obvious opposites."
-                ):
-                    response += chunk
+                for past_conv in candidates
+            ]
+            
+            responses = self.claude.classify_many(
+                prompts,
+                system_prompt="You detect clear contradictions. Be conservative - only flag obvious opposites.",
+                max_tokens=60
+            )
+            
+            for past_conv, response in zip(candidates, responses):
+                if isinstance(response, Exception):
+                    raise response
                 
                 if response.strip().upper().startswith("YES"):
                     # Contradiction found!
                     explanation = response.split(":", 1)[1].strip() if ":" in response else "Views conflict"
                     
-                    alert = {
-                        "alert_type": "contradiction",
-                        "title": "Potential Contradiction Detected",
-                        "content": f"Today: {new_message}\n\nPast ({past_conv['created_at'][:10]}): {past_conv['title']}\n\nNote: {explanation}",
-                        "related_conversation_ids": [current_conversation_id, str(past_conv['id'])],
-                        "severity": "medium"
-                    }
+                    alert = self._contradiction_alert(
+                        new_message, current_conversation_id, past_conv, explanation
+                    )
                     
                     # Save alert to database
                     self._save_alert(alert)
+                    # Keep only what the alert needs, not the transcript
+                    past = {k: past_conv[k] for k in ('id', 'title', 'created_at')}
+                    self._store_verdict(key, (past, explanation, {current_conversation_id}))
                     
                     logger.info(f"✓ Contradiction detected and saved")
                     return alert
             
+            self._store_verdict(key, None)
             return None
             
         except Exception as e:
             logger.error(f"Error checking contradictions: {e}", exc_info=True)
             return None
     
+    def _similar_conversations(
+        self,
+        message: str,
+        embedding_str: str,
+        before: datetime,
+        exclude_id: str
+    ) -> List[Dict[str, Any]]:
+        """
+        Top 5 past conversations by combined semantic and keyword relevance.
+        
+        Cosine neighbours miss exact names and tickers, so the exact cosine
+        top-N and a full-text top-N (any of the message's terms, ranked with
+        ts_rank_cd) come back in one round trip and are merged by a
+        weighted sum of cosine and max-normalized rank. Every row carries
+        its cosine similarity.
+        """
+        # Ordered by the computed similarity, not the bare <#> operator, so
+        # this is an exact scan: HNSW would return only its ~ef_search
+        # nearest rows before the created_at filter, and a month of recent
+        # conversations on the same topic would leave nothing older.
+        # Embeddings are unit length, so -(a <#> b) is the cosine.
+        query = """
+        (
+            SELECT id, title, created_at::text AS created_at,
+                -(embedding <#> %s::vector) AS similarity,
+                0.0::real AS rank
+            FROM conversations
+            WHERE embedding IS NOT NULL
+            AND created_at < %s
+            AND id != %s::uuid
+            ORDER BY similarity DESC
+            LIMIT %s
+        )
+        UNION ALL
+        (
+            SELECT id, title, created_at::text AS created_at,
+                -(embedding <#> %s::vector) AS similarity,
+                ts_rank_cd(search_vector, q.tsq) AS rank
+            FROM conversations,
+                to_tsquery('simple', replace(plainto_tsquery('english', %s)::text, '&', '|')) AS q(tsq)
+            WHERE search_vector @@ q.tsq
+            AND embedding IS NOT NULL
+            AND created_at < %s
+            AND id != %s::uuid
+            ORDER BY rank DESC
+            LIMIT %s
+        )
+        """
+        
+        before_str = before.isoformat()
+        rows = self.db.execute_query(
+            query,
+            (
+                embedding_str, before_str, exclude_id, _CANDIDATES_PER_SEARCH,
+                embedding_str, message, before_str, exclude_id, _CANDIDATES_PER_SEARCH
+            )
+        )
+        
+        # A row found by both searches keeps its keyword rank
+        merged = {}
+        for row in rows:
+            seen = merged.get(row['id'])
+            if seen is None or row['rank'] > seen['rank']:
+                merged[row['id']] = row
+        if not merged:
+            return []
+        
+        max_rank = max(row['rank'] for row in merged.values()) or 1.0
+        return sorted(
+            merged.values(),
+            key=lambda row: _HYBRID_ALPHA * row['similarity'] + (1 - _HYBRID_ALPHA) * row['rank'] / max_rank,
+            reverse=True
+        )[:5]
+    
+    def _contradiction_alert(
+        self,
+        new_message: str,
+        current_conversation_id: str,
+        past_conv: Dict[str, Any],
+        explanation: str
+    ) -> Dict[str, Any]:
+        """Build the alert dict for a detected contradiction."""
+        return {
+            "alert_type": "contradiction",
+            "title": "Potential Contradiction Detected",
+            "content": f"Today: {new_message}\n\nPast ({past_conv['created_at'][:10]}): {past_conv['title']}\n\nNote: {explanation}",
+            "related_conversation_ids": [current_conversation_id, str(past_conv['id'])],
+            "severity": "medium"
+        }
+    
+    def _cached_verdict(self, key: str) -> Tuple[bool, Optional[tuple]]:
+        """
+        Look up the verdict for this exact message.
+        
+        Returns:
+            (found, verdict) - verdict is None when no contradiction was
+            found, else (past_conv, explanation, alerted_conversation_ids)
+        """
+        now = time.monotonic()
+        with self._verdicts_lock:
+            for stale in [k for k, entry in self._verdicts.items() if entry[0] <= now]:
+                del self._verdicts[stale]
+            
+            entry = self._verdicts.get(key)
+            if entry is None:
+                return False, None
+            self._verdicts.move_to_end(key)
+            return True, entry[1]
+    
+    def _store_verdict(self, key: str, verdict: Optional[tuple]):
+        with self._verdicts_lock:
+            self._verdicts[key] = (time.monotonic() + _CONTRADICTION_CACHE_TTL, verdict)
+            self._verdicts.move_to_end(key)
+            while len(self._verdicts) > _CONTRADICTION_CACHE_SIZE:
+                self._verdicts.popitem(last=False)
+    
     def get_pending_alerts(self) -> List[Dict[str, Any]]:
         """
         Get all unviewed, non-dismissed alerts.
@@ -262,11 +424,7 @@ Respond ONLY with:
             WHERE id = %s
             """
             
-            with self.db.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(query, (alert_id,))
-                cursor.close()
-            
+            self.db.execute_update(query, (alert_id,))
             return True
             
         except Exception as e:
@@ -290,72 +448,88 @@ Respond ONLY with:
             logger.error(f"Error fetching digest: {e}")
             return None
     
-    def _extract_topics(self, conversations: List[Dict]) -> List[str]:
-        """Extract top topics from conversations."""
-        topic_counts = {}
+    def _summarize_week(self, since: datetime) -> Dict[str, Any]:
+        """
+        Gather every digest input for conversations created since `since`.
         
-        for conv in conversations:
-            metadata = conv.get('metadata', {})
-            if isinstance(metadata, str):
-                metadata = json.loads(metadata)
-            
-            topics = metadata.get('topics', [])
-            for topic in topics:
-                topic_counts[topic] = topic_counts.get(topic, 0) + 1
+        One query over the window returns the conversation count, the top
+        10 topics from metadata->'topics', and the most active weekday
+        (ties go to the day with the most recent conversation). Only these
+        aggregates cross the network.
+        """
+        query = """
+        WITH week AS (
+            SELECT metadata, created_at
+            FROM conversations
+            WHERE created_at >= %s
+        )
+        SELECT
+            (SELECT COUNT(*) FROM week) AS conversation_count,
+            ARRAY(
+                SELECT topic
+                FROM week, jsonb_array_elements_text(week.metadata->'topics') AS topic
+                GROUP BY topic
+                ORDER BY COUNT(*) DESC, topic
+                LIMIT 10
+            ) AS topics,
+            (
+                SELECT to_char(created_at, 'FMDay')
+                FROM week
+                GROUP BY 1
+                ORDER BY COUNT(*) DESC, MAX(created_at) DESC
+                LIMIT 1
+            ) AS most_active_day
+        """
         
-        # Return top 10 topics
-        sorted_topics = sorted(topic_counts.items(), key=lambda x: x[1], reverse=True)
-        return [topic for topic, count in sorted_topics[:10]]
-    
-    def _identify_patterns(self, conversations: List[Dict]) -> Dict[str, Any]:
-        """Identify patterns in conversation data."""
+        row = self.db.execute_query(query, (since.isoformat(),))[0]
+        count = row['conversation_count']
         return {
-            "total_conversations": len(conversations),
-            "avg_per_day": round(len(conversations) / 7, 1),
-            "most_active_day": self._get_most_active_day(conversations)
+            "conversation_count": count,
+            "topics": row['topics'],
+            "patterns": {
+                "total_conversations": count,
+                "avg_per_day": round(count / 7, 1),
+                "most_active_day": row['most_active_day'] or "Unknown"
+            }
         }
     
-    def _get_most_active_day(self, conversations: List[Dict]) -> str:
-        """Find most active day of the week."""
-        day_counts = {}
-        
-        for conv in conversations:
-            created_at = datetime.fromisoformat(conv['created_at'].replace('Z', '+00:00'))
-            day_name = created_at.strftime('%A')
-            day_counts[day_name] = day_counts.get(day_name, 0) + 1
-        
-        if not day_counts:
-            return "Unknown"
-        
-        most_active = max(day_counts.items(), key=lambda x: x[1])
-        return most_active[0]
-    
     def _save_alert(self, alert: Dict[str, Any]) -> Optional[str]:
         """Save alert to database."""
+        alert_ids = self._save_alerts([alert])
+        return alert_ids[0] if alert_ids else None
+    
+    def _save_alerts(self, alerts: List[Dict[str, Any]]) -> List[str]:
+        """
+        Save several alerts in one round trip.
+        
+        Returns:
+            New alert IDs in input order, or an empty list on error
+        """
         try:
             query = """
             INSERT INTO insight_alerts
             (alert_type, title, content, related_conversation_ids, severity)
-            VALUES (%s, %s, %s, %s, %s)
+            VALUES %s
             RETURNING id
             """
             
-            alert_id = self.db.execute_insert(
+            return self.db.execute_insert_many(
                 query,
-                (
-                    alert['alert_type'],
-                    alert['title'],
-                    alert['content'],
-                    alert.get('related_conversation_ids', []),
-                    alert.get('severity', 'low')
-                )
+                [
+                    (
+                        alert['alert_type'],
+                        alert['title'],
+                        alert['content'],
+                        alert.get('related_conversation_ids', []),
+                        alert.get('severity', 'low')
+                    )
+                    for alert in alerts
+                ]
             )
             
-            return alert_id
-            
         except Exception as e:
             logger.error(f"Error saving alert: {e}")
-            return None
+            return []
     
     def _send_digest_email(self, digest: str, week_start, week_end):
         """Send digest via email if configured."""
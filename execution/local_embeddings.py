@@ -5,39 +5,240 @@ Uses BAAI/bge-small-en-v1.5 (384-dim)
 
 from sentence_transformers import SentenceTransformer
 import streamlit as st
+from collections import OrderedDict
+from typing import Optional
+import hashlib
 import logging
+import numpy as np
+import os
+import threading
+import torch
 
 logger = logging.getLogger(__name__)
 
+MODEL_NAME = "BAAI/bge-small-en-v1.5"
+
+# Recent embed_query results, keyed by a digest so long transcripts aren't
+# kept alive as cache keys
+_QUERY_CACHE_SIZE = 1024
+
+# The model reads at most 512 tokens; at roughly 4 characters a token,
+# longer texts are embedded in chunks of this many characters
+_CHUNK_CHARS = 2000
+
+# Dynamically quantized INT8 export, built once per container
+_INT8_DIR = os.path.expanduser("~/.cache/second_brain/bge-small-en-v1.5-int8")
+_INT8_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+
+
+def _load_int8_model() -> SentenceTransformer:
+    """
+    Load the ONNX INT8 model, exporting and quantizing it on first use.
+
+    Needs sentence-transformers >= 3.2 with the onnx extra installed.
+    """
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    if not os.path.exists(os.path.join(_INT8_DIR, _INT8_FILE)):
+        logger.info("Quantizing embeddings model to INT8...")
+        fp32 = SentenceTransformer(MODEL_NAME, backend="onnx")
+        fp32.save(_INT8_DIR)
+        export_dynamic_quantized_onnx_model(fp32, "avx512_vnni", _INT8_DIR)
+
+    return SentenceTransformer(
+        _INT8_DIR,
+        backend="onnx",
+        model_kwargs={"file_name": _INT8_FILE}
+    )
+
+
+def _compile_model(model: SentenceTransformer) -> SentenceTransformer:
+    """
+    Fuse the transformer's ops with torch.compile.
+
+    Compilation happens on the first call, so it is triggered here while
+    the loader holds its lock; any failure keeps the eager module.
+    """
+    eager = model[0].auto_model
+    try:
+        model[0].auto_model = torch.compile(eager, dynamic=True)
+        with torch.inference_mode():
+            model.encode("warmup", convert_to_numpy=True)
+    except Exception as e:
+        logger.warning("torch.compile unavailable, using eager model: %s", e)
+        model[0].auto_model = eager
+    return model
+
+
+def _load_model() -> SentenceTransformer:
+    """Load the model on the backend chosen by the EMBEDDINGS_BACKEND secret."""
+    backend = str(st.secrets.get("EMBEDDINGS_BACKEND", "torch")).lower()
+    if backend == "onnx-int8":
+        try:
+            return _load_int8_model()
+        except Exception as e:
+            logger.warning("INT8 embeddings unavailable, falling back to torch: %s", e)
+
+    model = SentenceTransformer(MODEL_NAME)
+    model.eval()
+    if str(st.secrets.get("EMBEDDINGS_COMPILE", "false")).lower() == "true":
+        model = _compile_model(model)
+    return model
+
+
+def _chunk_text(text: str, max_chars: int = _CHUNK_CHARS) -> list[str]:
+    """
+    Pack paragraphs (message boundaries, in a transcript) into chunks.
+
+    A paragraph longer than max_chars is cut at the limit. Always returns
+    at least one chunk.
+    """
+    chunks = []
+    current = ""
+    for paragraph in text.split("\n\n"):
+        while len(paragraph) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + 2 + len(paragraph) > max_chars:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current or not chunks:
+        chunks.append(current)
+    return chunks
+
 
 class EmbeddingsWrapper:
     def __init__(self, model: SentenceTransformer):
         self.model = model
+        self._query_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._query_cache_lock = threading.Lock()
 
-    def embed_query(self, text: str):
-        return self.model.encode(
+    # inference_mode skips autograd and version-counter bookkeeping,
+    # which no_grad inside encode still pays
+    @torch.inference_mode()
+    def _encode_query(self, text: str) -> np.ndarray:
+        embedding = self.model.encode(
             text,
             convert_to_numpy=True,
             normalize_embeddings=True
-        ).tolist()
+        ).astype(np.float32, copy=False)
+        # Shared by every caller that hits the cache, so it must not change
+        embedding.flags.writeable = False
+        return embedding
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """
+        Embed one text as a read-only, unit-length float32 vector.
+
+        The model normalizes inside encode, so callers never renormalize,
+        and the array goes straight into numpy math or vector_literal
+        without a per-element float conversion.
+        """
+        # Reruns, the Grok cache, retrieval and the contradiction check often
+        # embed the same text. The tokenizer ignores surrounding whitespace,
+        # so it is stripped from the key to share entries across variants.
+        key = hashlib.blake2b(text.strip().encode(), digest_size=16).digest()
+        with self._query_cache_lock:
+            cached = self._query_cache.get(key)
+            if cached is not None:
+                self._query_cache.move_to_end(key)
+                return cached
+
+        embedding = self._encode_query(text)
+        with self._query_cache_lock:
+            self._query_cache[key] = embedding
+            if len(self._query_cache) > _QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return embedding
+
+    @torch.inference_mode()
+    def embed_documents(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        """
+        Embed many texts in one batched encode.
+
+        Returns a float32 (len(texts), 384) matrix of normalized rows, so
+        `matrix @ query` gives cosine similarities directly.
+        """
+        return self.model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+
+    def embed_transcripts(self, texts: list[str], batch_size: int = 64) -> np.ndarray:
+        """
+        Embed long texts as the normalized mean of their chunk embeddings.
+
+        Encoding a whole transcript would silently drop everything past the
+        model's 512 tokens. Instead the chunks of every text go through one
+        batched encode and are pooled per text, giving a float32
+        (len(texts), 384) matrix of unit rows.
+        """
+        chunks = []
+        owners = []
+        for i, text in enumerate(texts):
+            for chunk in _chunk_text(text):
+                chunks.append(chunk)
+                owners.append(i)
+        if not chunks:
+            return np.empty((0, 384), dtype=np.float32)
 
-    def embed_documents(self, texts: list[str]):
-        return [
-            self.model.encode(
-                t,
-                convert_to_numpy=True,
-                normalize_embeddings=True
-            ).tolist()
-            for t in texts
-        ]
+        chunk_embeddings = self.embed_documents(chunks, batch_size=batch_size)
+        pooled = np.zeros((len(texts), chunk_embeddings.shape[1]), dtype=np.float32)
+        np.add.at(pooled, owners, chunk_embeddings)
+        pooled /= np.linalg.norm(pooled, axis=1, keepdims=True) + 1e-12
+        return pooled
 
 
-@st.cache_resource
-def get_embeddings():
+_embeddings: Optional[EmbeddingsWrapper] = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings() -> EmbeddingsWrapper:
     """
     Load and cache the sentence transformer model.
     """
-    logger.info("Loading embeddings model...")
-    model = SentenceTransformer("BAAI/bge-small-en-v1.5")
-    logger.info("Embeddings model loaded")
-    return EmbeddingsWrapper(model)
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                logger.info("Loading embeddings model...")
+                model = _load_model()
+                logger.info("Embeddings model loaded")
+                _embeddings = EmbeddingsWrapper(model)
+    return _embeddings
+
+
+_warmup_started = False
+_warmup_lock = threading.Lock()
+
+
+def _warm_up():
+    """Load the model and run one encode so first-call setup is paid up front."""
+    try:
+        get_embeddings().embed_query("warmup")
+        logger.info("Embeddings model warmed up")
+    except Exception as e:
+        logger.warning("Embeddings warmup failed: %s", e)
+
+
+def preload_embeddings():
+    """
+    Start loading and warming the model in the background, once per process.
+
+    A query that arrives before warmup finishes just waits on the loader's
+    lock instead of loading the model a second time.
+    """
+    global _warmup_started
+    with _warmup_lock:
+        if _warmup_started:
+            return
+        _warmup_started = True
+    threading.Thread(target=_warm_up, name="embeddings-warmup", daemon=True).start()
@@ -5,6 +5,7 @@ Creates new tables for insights and alerts
 
 from execution.db_manager import get_db_manager
 import logging
+import psycopg2
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,8 +17,6 @@ def run_migration():
     db = get_db_manager()
     
     # Table 1: insight_alerts
-    logger.info("Creating insight_alerts table...")
-    
     create_alerts_table = """
     CREATE TABLE IF NOT EXISTS insight_alerts (
         id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -33,32 +32,14 @@ def run_migration():
     );
     """
     
-    with db.get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(create_alerts_table)
-        cursor.close()
-    
-    logger.info("✓ insight_alerts table created")
-    
     # Create indexes for alerts
-    logger.info("Creating indexes for insight_alerts...")
-    
     create_alerts_indexes = """
     CREATE INDEX IF NOT EXISTS idx_alerts_type ON insight_alerts(alert_type);
     CREATE INDEX IF NOT EXISTS idx_alerts_dismissed ON insight_alerts(dismissed);
     CREATE INDEX IF NOT EXISTS idx_alerts_created ON insight_alerts(created_at DESC);
     """
     
-    with db.get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(create_alerts_indexes)
-        cursor.close()
-    
-    logger.info("✓ Indexes created for insight_alerts")
-    
     # Table 2: weekly_digests
-    logger.info("Creating weekly_digests table...")
-    
     create_digests_table = """
     CREATE TABLE IF NOT EXISTS weekly_digests (
         id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -72,26 +53,63 @@ def run_migration():
     );
     """
     
-    with db.get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(create_digests_table)
-        cursor.close()
-    
-    logger.info("✓ weekly_digests table created")
-    
     # Create indexes for digests
-    logger.info("Creating indexes for weekly_digests...")
-    
     create_digests_indexes = """
     CREATE INDEX IF NOT EXISTS idx_digests_week ON weekly_digests(week_start DESC);
     """
     
-    with db.get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(create_digests_indexes)
-        cursor.close()
+    # ANN index for memory search. Embeddings are stored L2-normalized, so
+    # inner product ranks exactly like cosine and is cheaper to compute.
+    # GIN index for keyword search over the stored search_vector column.
+    # B-tree on created_at for the digest window and contradiction cutoff.
+    create_conversations_indexes = """
+    CREATE INDEX IF NOT EXISTS idx_conversations_embedding_hnsw
+        ON conversations USING hnsw (embedding vector_ip_ops)
+        WITH (m = 16, ef_construction = 64);
+    CREATE INDEX IF NOT EXISTS idx_conversations_search_vector
+        ON conversations USING gin (search_vector);
+    CREATE INDEX IF NOT EXISTS idx_conversations_created
+        ON conversations (created_at DESC);
+    """
     
-    logger.info("✓ Indexes created for weekly_digests")
+    # Half-precision copy of each embedding, kept in sync by Postgres, with
+    # its own inner-product HNSW index. Searches use it when the
+    # HALFVEC_EMBEDDINGS secret is set. Needs pgvector >= 0.7.
+    create_halfvec_embeddings = """
+    ALTER TABLE conversations
+        ADD COLUMN IF NOT EXISTS embedding_half halfvec(384)
+        GENERATED ALWAYS AS (embedding::halfvec(384)) STORED;
+    CREATE INDEX IF NOT EXISTS idx_conversations_embedding_half_hnsw
+        ON conversations USING hnsw (embedding_half halfvec_ip_ops)
+        WITH (m = 16, ef_construction = 64);
+    """
+    
+    # One round trip and one transaction: a failure leaves nothing half-built
+    logger.info("Creating insight_alerts and weekly_digests tables and indexes...")
+    
+    with db.get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                create_alerts_table
+                + create_alerts_indexes
+                + create_digests_table
+                + create_digests_indexes
+                + create_conversations_indexes
+            )
+    
+    logger.info("✓ insight_alerts and weekly_digests tables and indexes created")
+    logger.info("✓ HNSW index created for conversations.embedding")
+    logger.info("✓ GIN index created for conversations.search_vector")
+    logger.info("✓ created_at index created for conversations")
+    
+    # Separate transaction, so an older pgvector only skips this step
+    try:
+        with db.get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(create_halfvec_embeddings)
+        logger.info("✓ halfvec embedding column and HNSW index created")
+    except psycopg2.Error as e:
+        logger.warning("Skipped halfvec embeddings (needs pgvector >= 0.7): %s", e)
     
     logger.info("=" * 50)
     logger.info("✅ Database migration complete!")
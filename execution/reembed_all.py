@@ -1,29 +1,45 @@
-from execution.db_manager import get_db_manager
+from itertools import islice
+
+from execution.db_manager import get_db_manager, vector_literal
 from execution.local_embeddings import get_embeddings
 
+BATCH_SIZE = 256
+
 def main():
     db = get_db_manager()
     embeddings = get_embeddings()
 
-    rows = db.execute_query("""
+    total = db.execute_query("""
+        SELECT COUNT(*) AS total
+        FROM conversations
+        WHERE embedding IS NULL
+    """)[0]["total"]
+
+    print(f"Found {total} conversations to re-embed")
+
+    # Transcripts are streamed so the whole table never sits in memory
+    rows = db.stream_query("""
         SELECT id, full_transcript
         FROM conversations
         WHERE embedding IS NULL
     """)
 
-    print(f"Found {len(rows)} conversations to re-embed")
-
-    for i, row in enumerate(rows, 1):
-        emb = embeddings.embed_query(row["full_transcript"])
-        emb_str = "[" + ",".join(map(str, emb)) + "]"
+    done = 0
+    # One batched encode and one round trip of UPDATEs per BATCH_SIZE rows
+    while batch := list(islice(rows, BATCH_SIZE)):
+        embs = embeddings.embed_transcripts([row["full_transcript"] or "" for row in batch])
 
-        db.execute("""
+        db.execute_batch("""
             UPDATE conversations
             SET embedding = %s::vector
             WHERE id = %s
-        """, (emb_str, row["id"]))
+        """, [
+            (vector_literal(emb), row["id"])
+            for emb, row in zip(embs, batch)
+        ], page_size=BATCH_SIZE)
 
-        print(f"[{i}/{len(rows)}] Updated {row['id']}")
+        done += len(batch)
+        print(f"[{done}/{total}] Updated {len(batch)} conversations")
 
     print("✅ Re-embedding complete")
 
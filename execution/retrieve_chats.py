@@ -4,10 +4,11 @@ Vector + keyword search with time-weighting and MMR
 """
 
 import numpy as np
-from datetime import datetime, timedelta
 import logging
+import orjson
 import streamlit as st
-from execution.db_manager import get_db_manager
+import time
+from execution.db_manager import get_db_manager, vector_literal
 from execution.local_embeddings import get_embeddings
 
 logger = logging.getLogger(__name__)
@@ -15,9 +16,10 @@ logger = logging.getLogger(__name__)
 
 class Document:
     """Retrieved document representation."""
-    def __init__(self, page_content: str, metadata: dict):
+    def __init__(self, page_content: str, metadata: dict, embedding: np.ndarray = None):
         self.page_content = page_content
         self.metadata = metadata
+        self.embedding = embedding
 
 
 def hybrid_retrieve(query: str, conversation_id: str, turn_number: int, top_k: int = None):
@@ -41,34 +43,19 @@ def hybrid_retrieve(query: str, conversation_id: str, turn_number: int, top_k: i
         
         session_cutoff = turn_number - session_limit
         
-        # Vector search
-        vector_results = _vector_search(
-            query_embedding,
-            conversation_id,
-            session_cutoff,
-            vector_k
-        )
-        
-        # Keyword search
-        keyword_results = _keyword_search(
+        # Vector + keyword search
+        vector_results, keyword_results = _search(
             query,
+            query_embedding,
             conversation_id,
             session_cutoff,
+            vector_k,
             keyword_k
         )
         
-        # Merge and score
-        merged = _merge_results(vector_results, keyword_results)
-        
-        # Time-weight
-        weighted = _apply_time_weighting(merged)
-        
-        # MMR diversity
-        if len(weighted) > top_k:
-            mmr_diversity = float(st.secrets.get("MMR_DIVERSITY", "0.3"))
-            final = _mmr_select(weighted, query_embedding, top_k, mmr_diversity)
-        else:
-            final = weighted[:top_k]
+        # Merge, time-weight and MMR in one ranking pass
+        mmr_diversity = float(st.secrets.get("MMR_DIVERSITY", "0.3"))
+        final = _rank(vector_results, keyword_results, query_embedding, top_k, mmr_diversity)
         
         logger.info(f"Retrieved {len(final)} conversations")
         return final
@@ -78,177 +65,216 @@ def hybrid_retrieve(query: str, conversation_id: str, turn_number: int, top_k: i
         return []
 
 
-def _vector_search(query_embedding, exclude_conv_id, exclude_turn, limit):
-    """Execute vector similarity search."""
-    db = get_db_manager()
-    embedding_str = '[' + ','.join(str(float(x)) for x in query_embedding) + ']'
-    
-    query = """
-    SELECT 
-        id,
-        title,
-        full_transcript AS content,
-        1 - (embedding <=> %s::vector) AS similarity,
-        metadata,
-        created_at::text AS timestamp
-    FROM conversations
-    WHERE NOT (
-        metadata->>'conversation_id' = %s 
-        AND COALESCE((metadata->>'turn_number')::int, 0) > %s
-    )
-    ORDER BY embedding <=> %s::vector
-    LIMIT %s
+def _search(query, query_embedding, exclude_conv_id, exclude_turn, vector_k, keyword_k):
     """
+    Execute vector similarity and keyword full-text search in one round trip.
     
-    results = db.execute_query(
-        query,
-        (embedding_str, exclude_conv_id, exclude_turn, embedding_str, limit)
-    )
-    
-    return results if results else []
-
-
-def _keyword_search(query, exclude_conv_id, exclude_turn, limit):
-    """Execute keyword full-text search."""
+    Each branch keeps its own ORDER BY/LIMIT; rows are tagged with their
+    source and split back into (vector_results, keyword_results). Stored
+    and query embeddings are unit length, so negative inner product (<#>,
+    served by the HNSW index) orders exactly like cosine distance. The
+    keyword branch parses its tsquery once and matches the stored
+    search_vector column through its GIN index.
+    """
     db = get_db_manager()
+    embedding_str = vector_literal(query_embedding)
+    ann = f"{db.ann_column} <#> %s::{db.ann_type}"
     
-    search_query = """
-    SELECT 
-        id,
-        title,
-        full_transcript AS content,
-        ts_rank(search_vector, websearch_to_tsquery('english', %s)) AS rank,
-        metadata,
-        created_at::text AS timestamp
-    FROM conversations
-    WHERE search_vector @@ websearch_to_tsquery('english', %s)
-    AND NOT (
-        metadata->>'conversation_id' = %s 
-        AND COALESCE((metadata->>'turn_number')::int, 0) > %s
+    search_query = f"""
+    (
+        SELECT 
+            'vector' AS source,
+            id,
+            title,
+            full_transcript AS content,
+            -({ann}) AS similarity,
+            NULL::real AS rank,
+            embedding,
+            metadata,
+            created_at::text AS timestamp,
+            EXTRACT(EPOCH FROM created_at)::float8 AS ts_epoch
+        FROM conversations
+        WHERE embedding IS NOT NULL
+        AND NOT (
+            metadata->>'conversation_id' = %s 
+            AND COALESCE((metadata->>'turn_number')::int, 0) > %s
+        )
+        ORDER BY {ann}
+        LIMIT %s
+    )
+    UNION ALL
+    (
+        SELECT 
+            'keyword' AS source,
+            id,
+            title,
+            full_transcript AS content,
+            NULL::float8 AS similarity,
+            ts_rank(search_vector, q.tsq) AS rank,
+            embedding,
+            metadata,
+            created_at::text AS timestamp,
+            EXTRACT(EPOCH FROM created_at)::float8 AS ts_epoch
+        FROM conversations, websearch_to_tsquery('english', %s) AS q(tsq)
+        WHERE search_vector @@ q.tsq
+        AND NOT (
+            metadata->>'conversation_id' = %s 
+            AND COALESCE((metadata->>'turn_number')::int, 0) > %s
+        )
+        ORDER BY rank DESC
+        LIMIT %s
     )
-    ORDER BY rank DESC
-    LIMIT %s
     """
     
-    results = db.execute_query(
+    results = db.execute_query_fast(
         search_query,
-        (query, query, exclude_conv_id, exclude_turn, limit)
+        (
+            embedding_str, exclude_conv_id, exclude_turn, embedding_str, vector_k,
+            query, exclude_conv_id, exclude_turn, keyword_k
+        )
     )
     
-    return results if results else []
+    vector_results = [row for row in results if row.source == 'vector']
+    keyword_results = [row for row in results if row.source == 'keyword']
+    return vector_results, keyword_results
+
+
+def _parse_vector(text):
+    """Decode pgvector's text form '[x,y,...]' (None for NULL)."""
+    if text is None:
+        return None
+    return np.asarray(orjson.loads(text), dtype=np.float32)
 
 
-def _merge_results(vector_results, keyword_results):
-    """Merge and deduplicate results."""
+def _rank(vector_results, keyword_results, query_embedding, top_k, diversity):
+    """
+    Merge, time-weight and diversify search results in a single pass.
+    
+    Candidates are deduplicated into parallel arrays (rows, sources, scores,
+    timestamps, embeddings) while each result list is walked once. Boosted
+    scores come from one vectorized expression and one argsort, and MMR
+    runs over the best few candidates only. Document objects are built
+    just for the rows returned.
+    """
+    recency_days = int(st.secrets.get("RECENCY_BOOST_DAYS", "7"))
+    
     seen_ids = set()
-    merged_docs = []
+    rows = []
+    sources = []
+    scores = []
     
-    # Process vector results
+    # Vector results first: a row found by both searches keeps its vector score
     for row in vector_results:
-        if row['id'] not in seen_ids:
-            doc = Document(
-                page_content=row['content'],
-                metadata={
-                    **row['metadata'],
-                    'id': str(row['id']),
-                    'title': row.get('title', 'Untitled'),
-                    'score': float(row['similarity']),
-                    'source': 'vector',
-                    'timestamp': row['timestamp']
-                }
-            )
-            merged_docs.append(doc)
-            seen_ids.add(row['id'])
-    
-    # Process keyword results
+        if row.id not in seen_ids:
+            rows.append(row)
+            sources.append('vector')
+            scores.append(float(row.similarity))
+            seen_ids.add(row.id)
+    
     for row in keyword_results:
-        if row['id'] not in seen_ids:
-            score = min(float(row['rank']) / 0.3, 1.0)
-            doc = Document(
-                page_content=row['content'],
-                metadata={
-                    **row['metadata'],
-                    'id': str(row['id']),
-                    'title': row.get('title', 'Untitled'),
-                    'score': score,
-                    'source': 'keyword',
-                    'timestamp': row['timestamp']
-                }
-            )
-            merged_docs.append(doc)
-            seen_ids.add(row['id'])
-    
-    # Sort by score
-    merged_docs.sort(key=lambda d: d.metadata['score'], reverse=True)
-    return merged_docs
-
-
-def _apply_time_weighting(documents):
-    """Apply time-based boost to scores."""
-    recency_days = int(st.secrets.get("RECENCY_BOOST_DAYS", "7"))
+        if row.id not in seen_ids:
+            rows.append(row)
+            sources.append('keyword')
+            scores.append(min(float(row.rank) / 0.3, 1.0))
+            seen_ids.add(row.id)
     
-    for doc in documents:
-        try:
-            timestamp = datetime.fromisoformat(doc.metadata['timestamp'].replace('Z', '+00:00'))
-            age = datetime.now(timestamp.tzinfo) - timestamp
-            
-            if age <= timedelta(days=recency_days):
-                boost = 1.2
-            elif age <= timedelta(days=30):
-                boost = 1.1
-            else:
-                boost = 1.0
-            
-            doc.metadata['score'] *= boost
-            doc.metadata['time_boost'] = boost
-        except:
-            pass
-    
-    # Re-sort by new scores
-    documents.sort(key=lambda d: d.metadata['score'], reverse=True)
-    return documents
-
-
-def _mmr_select(documents, query_embedding, k, diversity):
-    """Maximum Marginal Relevance selection for diversity."""
-    if len(documents) <= k:
-        return documents
-    
-    embeddings_model = get_embeddings()
-    
-    # Get embeddings for all documents
-    doc_embeddings = []
-    for doc in documents:
-        emb = embeddings_model.embed_query(doc.page_content[:500])
-        doc_embeddings.append(emb)
-    
-    doc_embeddings = np.array(doc_embeddings)
-    query_embedding = np.array(query_embedding).reshape(1, -1)
+    # Timestamps arrive as UTC epoch seconds (NULL becomes NaN and keeps a
+    # 1.0 boost), so `now` is read once and nothing is parsed per row
+    timestamps = np.asarray([row.ts_epoch for row in rows], dtype=np.float64)
+    age_days = (time.time() - timestamps) / 86400
+    boosts = np.select([age_days <= recency_days, age_days <= 30], [1.2, 1.1], default=1.0)
+    scores = np.asarray(scores, dtype=np.float64) * boosts
     
-    # Calculate similarities
-    similarities = (query_embedding @ doc_embeddings.T)[0]
+    candidates = {
+        'rows': rows,
+        'sources': sources,
+        'scores': scores,
+        'timestamps': timestamps,
+        'boosts': boosts,
+        'embeddings': [_parse_vector(row.embedding) for row in rows],
+    }
     
-    selected_indices = []
-    remaining_indices = list(range(len(documents)))
+    # Best first; MMR only needs a few times top_k to choose from
+    order = np.argsort(-scores, kind='stable')[:max(top_k * 4, 32)]
+    
+    if len(order) > top_k:
+        picked = _mmr_select(candidates, order, query_embedding, top_k, diversity)
+    else:
+        picked = order[:top_k]
+    
+    return [_to_document(candidates, i) for i in picked]
+
+
+def _to_document(candidates, i):
+    """Build the Document for candidate i."""
+    row = candidates['rows'][i]
+    metadata = {
+        **row.metadata,
+        'id': str(row.id),
+        'title': row.title,
+        'score': float(candidates['scores'][i]),
+        'source': candidates['sources'][i],
+        'timestamp': row.timestamp
+    }
+    if not np.isnan(candidates['timestamps'][i]):
+        metadata['time_boost'] = float(candidates['boosts'][i])
+    return Document(
+        page_content=row.content,
+        metadata=metadata,
+        embedding=candidates['embeddings'][i]
+    )
+
+
+def _mmr_select(candidates, order, query_embedding, k, diversity):
+    """
+    Maximum Marginal Relevance selection for diversity.
+    
+    Works over the candidates in ranked `order` and returns the selected
+    candidate indices.
+    """
+    if len(order) <= k:
+        return order
+    
+    # Rows carry their stored embeddings; only rows never embedded
+    # (embedding IS NULL) are encoded here, in one batch
+    embeddings = candidates['embeddings']
+    missing = [i for i in order if embeddings[i] is None]
+    if missing:
+        fresh = get_embeddings().embed_documents(
+            [candidates['rows'][i].content[:500] for i in missing]
+        )
+        for i, emb in zip(missing, fresh):
+            embeddings[i] = emb
+    
+    # float32 rows normalized once, so every score below is a cosine from a
+    # single BLAS matrix-vector product
+    doc_embeddings = np.stack([embeddings[i] for i in order]).astype(np.float32, copy=False)
+    doc_embeddings /= np.linalg.norm(doc_embeddings, axis=1, keepdims=True) + 1e-12
+    query_embedding = np.asarray(query_embedding, dtype=np.float32)
+    query_embedding = query_embedding / (np.linalg.norm(query_embedding) + 1e-12)
+    
+    # Calculate similarities
+    similarities = doc_embeddings @ query_embedding
     
     # Select first (highest similarity)
     best_idx = int(np.argmax(similarities))
-    selected_indices.append(best_idx)
-    remaining_indices.remove(best_idx)
+    selected_indices = [best_idx]
+    
+    # Each document's redundancy is its max similarity to anything selected.
+    # Keep that as a running vector, updated against the newest pick only,
+    # instead of rescoring every remaining document against the whole set.
+    max_redundancy = doc_embeddings @ doc_embeddings[best_idx]
+    available = np.ones(len(order), dtype=bool)
+    available[best_idx] = False
     
     # Iteratively select k-1 more
-    while len(selected_indices) < k and remaining_indices:
-        mmr_scores = []
-        
-        for idx in remaining_indices:
-            relevance = similarities[idx]
-            selected_embs = doc_embeddings[selected_indices]
-            redundancy = (doc_embeddings[idx:idx+1] @ selected_embs.T).max()
-            mmr = (1 - diversity) * relevance - diversity * redundancy
-            mmr_scores.append((idx, mmr))
+    while len(selected_indices) < k:
+        mmr = (1 - diversity) * similarities - diversity * max_redundancy
+        mmr[~available] = -np.inf
         
-        best_idx = max(mmr_scores, key=lambda x: x[1])[0]
+        best_idx = int(np.argmax(mmr))
         selected_indices.append(best_idx)
-        remaining_indices.remove(best_idx)
+        available[best_idx] = False
+        np.maximum(max_redundancy, doc_embeddings @ doc_embeddings[best_idx], out=max_redundancy)
     
-    return [documents[i] for i in selected_indices]
+    return [order[i] for i in selected_indices]
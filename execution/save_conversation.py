@@ -3,15 +3,34 @@ Conversation Saver - Cloud-Native - FIXED VERSION
 Stores complete chat sessions with embeddings
 """
 
-import json
+import orjson
+import re
+from collections import Counter
 from datetime import datetime
 from uuid import uuid4
 import logging
-from execution.db_manager import get_db_manager
+from execution.db_manager import get_db_manager, vector_literal
 from execution.local_embeddings import get_embeddings
 
 logger = logging.getLogger(__name__)
 
+# ciso8601 is an optional C parser, several times faster than fromisoformat
+try:
+    from ciso8601 import parse_datetime as _parse_timestamp
+except ImportError:
+    def _parse_timestamp(timestamp: str) -> datetime:
+        return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+
+INVESTMENT_KEYWORDS = frozenset({
+    'dividend', 'dividends', 'stock', 'stocks', 'portfolio', 'allocation',
+    'risk', 'investing', 'investment', 'bonds', 'equity', 'value',
+    'growth', 'income', 'retirement', 'diversification', 'market',
+    'analysis', 'valuation', 'yield', 'returns', 'strategy'
+})
+
+# Everything that is neither alphanumeric nor whitespace
+_NON_WORD_CHARS = re.compile(r"[^\w\s]|_")
+
 
 def save_conversation(messages: list, conversation_id: str = None, metadata: dict = None):
     """
@@ -36,10 +55,10 @@ def save_conversation(messages: list, conversation_id: str = None, metadata: dic
         # Generate title
         title = _generate_title(messages)
         
-        # Generate embedding
+        # Generate embedding (pooled over transcript chunks in one batch)
         embeddings = get_embeddings()
-        embedding = embeddings.embed_query(transcript)
-        embedding_str = '[' + ','.join(str(float(x)) for x in embedding) + ']'
+        embedding = embeddings.embed_transcripts([transcript])[0]
+        embedding_str = vector_literal(embedding)
         
         # Extract topics
         topics = _extract_topics(transcript)
@@ -70,7 +89,7 @@ def save_conversation(messages: list, conversation_id: str = None, metadata: dic
         
         result_id = db.execute_insert(
             query,
-            (title, transcript, embedding_str, json.dumps(conv_metadata))
+            (title, transcript, embedding_str, orjson.dumps(conv_metadata).decode())
         )
         
         if result_id:
@@ -95,10 +114,10 @@ def _format_transcript(messages: list) -> str:
         
         if timestamp:
             try:
-                dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+                dt = _parse_timestamp(timestamp)
                 time_str = dt.strftime('%Y-%m-%d %H:%M:%S')
                 lines.append(f"[{time_str}] {role}: {content}")
-            except:
+            except (AttributeError, TypeError, ValueError):
                 lines.append(f"{role}: {content}")
         else:
             lines.append(f"{role}: {content}")
@@ -121,20 +140,8 @@ def _generate_title(messages: list, max_length: int = 100) -> str:
 
 def _extract_topics(transcript: str, max_topics: int = 5) -> list:
     """Extract topics from conversation (simple keyword extraction)."""
-    investment_keywords = {
-        'dividend', 'dividends', 'stock', 'stocks', 'portfolio', 'allocation',
-        'risk', 'investing', 'investment', 'bonds', 'equity', 'value',
-        'growth', 'income', 'retirement', 'diversification', 'market',
-        'analysis', 'valuation', 'yield', 'returns', 'strategy'
-    }
-    
-    words = transcript.lower().split()
-    topic_counts = {}
-    
-    for word in words:
-        clean_word = ''.join(c for c in word if c.isalnum())
-        if clean_word in investment_keywords:
-            topic_counts[clean_word] = topic_counts.get(clean_word, 0) + 1
-    
-    sorted_topics = sorted(topic_counts.items(), key=lambda x: x[1], reverse=True)
-    return [topic for topic, count in sorted_topics[:max_topics]]
+    # Strip punctuation from the whole transcript in one pass, then split,
+    # instead of rebuilding every word character by character
+    words = _NON_WORD_CHARS.sub('', transcript.lower()).split()
+    topic_counts = Counter(word for word in words if word in INVESTMENT_KEYWORDS)
+    return [topic for topic, count in topic_counts.most_common(max_topics)]
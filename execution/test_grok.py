@@ -1,22 +1,12 @@
-import requests
-import streamlit as st
+from execution.grok_handler import GrokClient
 
-XAI_API_KEY = st.secrets["XAI_API_KEY"]
+# Goes through the same pooled client, model and system prompt as the app,
+# printing tokens as they stream in
+grok = GrokClient()
 
-resp = requests.post(
-    "https://api.x.ai/v1/chat/completions",
-    headers={
-        "Authorization": f"Bearer {XAI_API_KEY}",
-        "Content-Type": "application/json"
-    },
-    json={
-        "model": "grok-beta",
-        "messages": [
-            {"role": "user", "content": "Say hello"}
-        ]
-    },
-    timeout=30
-)
-
-print(resp.status_code)
-print(resp.text)
+try:
+    for chunk in grok.stream_grok("Say hello"):
+        print(chunk, end="", flush=True)
+    print()
+except Exception as e:
+    print(f"Grok error: {e}")
@@ -5,12 +5,77 @@ Whisper Transcription + OpenAI TTS (primary) + Browser TTS (fallback)
 
 import streamlit as st
 import openai
+import httpx
+import hashlib
 import logging
-from typing import Optional
+import os
+import tempfile
+import threading
+import wave
+from collections import OrderedDict
+from typing import Iterator, Optional
 import io
+from execution.http_clients import SSL_CONTEXT, POOL_LIMITS
 
 logger = logging.getLogger(__name__)
 
+# Long-lived HTTP/2 client so Whisper and TTS calls reuse a warm connection;
+# audio uploads and long utterances get more generous write/read limits
+_SHARED_HTTPX = httpx.Client(
+    http2=True,
+    verify=SSL_CONTEXT,
+    limits=POOL_LIMITS,
+    timeout=httpx.Timeout(connect=5.0, read=120.0, write=60.0, pool=5.0)
+)
+
+# Synthesized speech for repeated short texts: memory LRU backed by disk
+_TTS_CACHE_DIR = os.path.expanduser("~/.cache/second_brain/tts")
+_TTS_MEM_CACHE_SIZE = 128
+_TTS_CACHE_MAX_CHARS = 1000
+
+# Layer III bitrates (kbps) by header index, for MPEG-1 and MPEG-2/2.5
+_MP3_BITRATES_V1 = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0)
+_MP3_BITRATES_V2 = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0)
+
+
+def _wav_duration(audio_bytes: bytes) -> Optional[float]:
+    """Duration from the WAV header, or None if it isn't a readable WAV."""
+    try:
+        with wave.open(io.BytesIO(audio_bytes)) as wav:
+            frame_size = wav.getnchannels() * wav.getsampwidth()
+            # Streamed recordings may leave a placeholder data size in the
+            # header, so never count more frames than the bytes can hold
+            frames = min(wav.getnframes(), (len(audio_bytes) - 44) // frame_size)
+            return frames / wav.getframerate()
+    except (wave.Error, EOFError, ZeroDivisionError):
+        return None
+
+
+def _mp3_duration(audio_bytes: bytes) -> Optional[float]:
+    """Duration of a constant-bitrate MP3 from its first frame header."""
+    offset = 0
+    if audio_bytes[:3] == b"ID3" and len(audio_bytes) >= 10:
+        # Syncsafe tag size: 7 bits per byte
+        size = 0
+        for b in audio_bytes[6:10]:
+            size = (size << 7) | (b & 0x7F)
+        offset = 10 + size + (10 if audio_bytes[5] & 0x10 else 0)
+
+    header = audio_bytes[offset:offset + 4]
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+
+    version = (header[1] >> 3) & 0x3
+    layer = (header[1] >> 1) & 0x3
+    if version == 1 or layer != 1:
+        return None  # reserved version, or not Layer III
+
+    table = _MP3_BITRATES_V1 if version == 3 else _MP3_BITRATES_V2
+    kbps = table[header[2] >> 4]
+    if not kbps:
+        return None
+    return (len(audio_bytes) - offset) * 8 / (kbps * 1000)
+
 
 class VoiceHandler:
     """
@@ -19,13 +84,43 @@ class VoiceHandler:
 
     def __init__(self):
         try:
-            openai.api_key = st.secrets["OPENAI_API_KEY"]
-            self.client = openai
+            self.client = openai.OpenAI(
+                api_key=st.secrets["OPENAI_API_KEY"],
+                http_client=_SHARED_HTTPX
+            )
             logger.info("✓ Voice handler initialized (Whisper + OpenAI TTS)")
         except Exception as e:
             logger.error(f"Failed to initialize voice handler: {e}")
             raise
 
+        self._tts_cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._tts_cache_lock = threading.Lock()
+
+        self.local_whisper = None
+        if str(st.secrets.get("USE_LOCAL_WHISPER", "false")).lower() == "true":
+            self.local_whisper = self._load_local_whisper()
+
+    def _load_local_whisper(self):
+        """
+        Load faster-whisper (CTranslate2, INT8 on CPU) for on-box transcription.
+
+        Optional dependency: returns None, leaving the API path in charge,
+        if it is not installed or the model can't be loaded.
+        """
+        try:
+            from faster_whisper import WhisperModel
+
+            model = WhisperModel(
+                st.secrets.get("LOCAL_WHISPER_MODEL", "small.en"),
+                device="cpu",
+                compute_type="int8"
+            )
+            logger.info("✓ Local Whisper model loaded")
+            return model
+        except Exception as e:
+            logger.warning(f"Local Whisper unavailable, using the API: {e}")
+            return None
+
     # ==========================
     # VOICE INPUT (WHISPER)
     # ==========================
@@ -34,6 +129,17 @@ class VoiceHandler:
         audio_bytes: bytes,
         audio_format: str = "wav"
     ) -> Optional[str]:
+        if self.local_whisper is not None:
+            try:
+                segments, _ = self.local_whisper.transcribe(
+                    io.BytesIO(audio_bytes),
+                    beam_size=1,
+                    vad_filter=True
+                )
+                return "".join(segment.text for segment in segments).strip()
+            except Exception as e:
+                logger.warning(f"Local transcription failed, using the API: {e}")
+
         try:
             audio_file = io.BytesIO(audio_bytes)
             audio_file.name = f"audio.{audio_format}"
@@ -52,6 +158,32 @@ class VoiceHandler:
     # ==========================
     # VOICE OUTPUT (OPENAI TTS)
     # ==========================
+    def generate_speech_stream(
+        self,
+        text: str,
+        voice: str = "onyx",
+        model: str = "gpt-4o-mini-tts",
+        chunk_size: int = 4096
+    ) -> Iterator[bytes]:
+        """
+        Stream synthesized speech as it is generated.
+
+        Playback can start on the first chunk instead of after the whole
+        utterance. Errors propagate to the caller.
+        """
+        if not text:
+            return
+
+        if len(text) > 4096:
+            text = text[:4096]
+
+        with self.client.audio.speech.with_streaming_response.create(
+            model=model,
+            voice=voice,
+            input=text
+        ) as response:
+            yield from response.iter_bytes(chunk_size=chunk_size)
+
     def generate_speech(
         self,
         text: str,
@@ -65,15 +197,18 @@ class VoiceHandler:
             if not text:
                 return None
 
-            if len(text) > 4096:
-                text = text[:4096]
+            cacheable = len(text) <= _TTS_CACHE_MAX_CHARS
+            if cacheable:
+                key = hashlib.sha1(f"{model}|{voice}|{text}".encode()).hexdigest()
+                audio_bytes = self._cached_speech(key)
+                if audio_bytes is not None:
+                    logger.info(f"✓ Speech served from cache ({len(audio_bytes)} bytes)")
+                    return audio_bytes
 
-            with self.client.audio.speech.with_streaming_response.create(
-                model=model,
-                voice=voice,
-                input=text
-            ) as response:
-                audio_bytes = response.read()
+            audio_bytes = b"".join(self.generate_speech_stream(text, voice, model))
+
+            if cacheable:
+                self._store_speech(key, audio_bytes)
 
             logger.info(f"✓ Generated speech ({len(audio_bytes)} bytes)")
             return audio_bytes
@@ -82,14 +217,66 @@ class VoiceHandler:
             logger.error(f"TTS error: {e}", exc_info=True)
             return None
 
+    def _cached_speech(self, key: str) -> Optional[bytes]:
+        """Look up synthesized audio in memory, then on disk."""
+        with self._tts_cache_lock:
+            audio_bytes = self._tts_cache.get(key)
+            if audio_bytes is not None:
+                self._tts_cache.move_to_end(key)
+                return audio_bytes
+
+        try:
+            with open(os.path.join(_TTS_CACHE_DIR, f"{key}.mp3"), "rb") as f:
+                audio_bytes = f.read()
+        except OSError:
+            return None
+
+        self._remember_speech(key, audio_bytes)
+        return audio_bytes
+
+    def _remember_speech(self, key: str, audio_bytes: bytes):
+        with self._tts_cache_lock:
+            self._tts_cache[key] = audio_bytes
+            self._tts_cache.move_to_end(key)
+            while len(self._tts_cache) > _TTS_MEM_CACHE_SIZE:
+                self._tts_cache.popitem(last=False)
+
+    def _store_speech(self, key: str, audio_bytes: bytes):
+        """Cache audio in memory and on disk; a failed disk write is only logged."""
+        self._remember_speech(key, audio_bytes)
+        try:
+            os.makedirs(_TTS_CACHE_DIR, exist_ok=True)
+            # Write then rename, so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=_TTS_CACHE_DIR, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(audio_bytes)
+            os.replace(tmp_path, os.path.join(_TTS_CACHE_DIR, f"{key}.mp3"))
+        except OSError as e:
+            logger.warning(f"Could not write TTS cache: {e}")
+
     # ==========================
     # COST ESTIMATION
     # ==========================
     def get_audio_duration_estimate(self, audio_bytes: bytes) -> float:
+        """
+        Audio duration in seconds, read from the container header.
+
+        WAV and MP3 are measured without decoding; other formats fall back
+        to a size-based guess.
+        """
+        if audio_bytes[:4] == b"RIFF" and audio_bytes[8:12] == b"WAVE":
+            duration = _wav_duration(audio_bytes)
+        else:
+            duration = _mp3_duration(audio_bytes)
+        if duration is not None:
+            return duration
+
         kb_size = len(audio_bytes) / 1024
         return kb_size / 16  # ~16KB/sec estimate
 
     def estimate_transcription_cost(self, audio_bytes: bytes) -> float:
+        if self.local_whisper is not None:
+            return 0.0  # transcribed on this machine
         minutes = (self.get_audio_duration_estimate(audio_bytes)) / 60
         return minutes * 0.006
 
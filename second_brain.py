@@ -7,7 +7,12 @@ Complete AI assistant with perfect memory, voice, real-time data, and weekly ins
 import streamlit as st
 from datetime import datetime
 from uuid import uuid4
+import functools
+import hashlib
 import logging
+import re
+import threading
+import time
 
 # Import execution modules
 from execution.retrieve_chats import hybrid_retrieve
@@ -15,15 +20,28 @@ from execution.save_conversation import save_conversation
 from execution.call_claude import get_claude_client
 from execution.voice_handler import get_voice_handler, create_tts_audio
 from execution.audio_recorder import audio_recorder_component
-from execution.grok_handler import get_grok_client, hybrid_query
+from execution.grok_handler import get_grok_client, submit_hybrid_query
 from execution.insights_engine import get_insights_engine
+from execution.local_embeddings import preload_embeddings
 
-# Setup logging
+# Setup logging (LOG_LEVEL=WARNING keeps per-turn INFO records off stderr)
+_log_level_name = str(st.secrets.get("LOG_LEVEL", "INFO")).upper()
+_log_level = logging.getLevelName(_log_level_name)
 logging.basicConfig(
-    level=logging.INFO,
+    level=_log_level if isinstance(_log_level, int) else logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+if not isinstance(_log_level, int):
+    logger.warning(f"Unknown LOG_LEVEL {_log_level_name!r}, using INFO")
+
+# Static, so it stays a cacheable prompt prefix; per-turn memories and
+# real-time data travel in the user turn instead
+SYSTEM_PROMPT = """You are Athena, a helpful AI assistant with perfect memory of all past conversations.
+
+Each message may open with relevant past conversations and, for some questions, real-time data from Grok.
+Use that information naturally when relevant. Don't mention the retrieval system or data sources.
+Be helpful, concise, and build on our conversation history."""
 
 # =============================================================================
 # PAGE CONFIGURATION
@@ -65,6 +83,9 @@ def init_session_state():
     if "voice_cost" not in st.session_state:
         st.session_state.voice_cost = 0.0
     
+    if "last_audio_hash" not in st.session_state:
+        st.session_state.last_audio_hash = None
+    
     # Grok cost tracking
     if "grok_cost" not in st.session_state:
         st.session_state.grok_cost = 0.0
@@ -83,47 +104,113 @@ def format_retrieved_memories(documents) -> str:
         return "No relevant past conversations found."
     
     # DEBUG: Log what we retrieved
-    logger.info(f"Formatting {len(documents)} retrieved documents")
-    for i, doc in enumerate(documents, 1):
-        if hasattr(doc, 'metadata'):
-            title = doc.metadata.get('title', 'Untitled')[:50]
-            score = doc.metadata.get('score', 0)
-            logger.info(f"  Doc {i}: {title}... (score: {score:.3f})")
-    
-    formatted = "=== RELEVANT PAST CONVERSATIONS ===\n\n"
-    
-    for i, doc in enumerate(documents, 1):
-        # Handle different document formats
-        if hasattr(doc, 'metadata'):
-            meta = doc.metadata
-            content = doc.page_content
-        elif isinstance(doc, dict):
-            meta = doc.get('metadata', {})
-            content = doc.get('page_content', doc.get('content', ''))
-        else:
-            continue
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Formatting {len(documents)} retrieved documents")
+        for i, doc in enumerate(documents, 1):
+            if hasattr(doc, 'metadata'):
+                title = doc.metadata.get('title', 'Untitled')[:50]
+                score = doc.metadata.get('score', 0)
+                logger.debug(f"  Doc {i}: {title}... (score: {score:.3f})")
+    
+    # Handle different document formats; a batch is all one type, so the
+    # accessor is picked once instead of per document
+    first = documents[0]
+    if hasattr(first, 'metadata'):
+        extract = lambda doc: (doc.metadata, doc.page_content)
+    elif isinstance(first, dict):
+        extract = lambda doc: (
+            doc.get('metadata', {}),
+            doc.get('page_content', doc.get('content', ''))
+        )
+    else:
+        extract = None
+    
+    parts = ["=== RELEVANT PAST CONVERSATIONS ===\n\n"]
+    
+    if extract is not None:
+        for i, doc in enumerate(documents, 1):
+            meta, content = extract(doc)
             
-        timestamp = meta.get('timestamp', 'Unknown')[:10] if isinstance(meta, dict) else 'Unknown'
-        score = meta.get('score', 0) if isinstance(meta, dict) else 0
-        title = meta.get('title', 'Untitled')
-        
-        formatted += f"[Memory {i}] ({timestamp}, relevance: {score:.2f})\n"
-        formatted += f"Title: {title}\n"
-        formatted += f"{content}\n\n"
+            timestamp = meta.get('timestamp', 'Unknown')[:10]
+            score = meta.get('score', 0)
+            title = meta.get('title', 'Untitled')
+            
+            parts.append(
+                f"[Memory {i}] ({timestamp}, relevance: {score:.2f})\n"
+                f"Title: {title}\n"
+                f"{content}\n\n"
+            )
     
+    formatted = "".join(parts)
     logger.info(f"Total formatted memory length: {len(formatted)} characters")
     return formatted
 
 
-def estimate_cost(input_tokens: int, output_tokens: int) -> float:
-    """Estimate cost for Claude Sonnet 4."""
-    input_cost = input_tokens * (3.00 / 1_000_000)
-    output_cost = output_tokens * (15.00 / 1_000_000)
+def estimate_cost(
+    input_tokens: int,
+    output_tokens: int,
+    model: str = "",
+    cache_write_tokens: int = 0,
+    cache_read_tokens: int = 0
+) -> float:
+    """
+    Estimate cost for Claude Sonnet 4 (or Haiku, for routed small talk).
+
+    input_tokens excludes prompt-cache traffic: cache writes bill at 1.25x
+    the input price and cache reads at 0.1x.
+    """
+    if "haiku" in model:
+        input_price, output_price = 1.00, 5.00
+    else:
+        input_price, output_price = 3.00, 15.00
+    billed_input = input_tokens + 1.25 * cache_write_tokens + 0.1 * cache_read_tokens
+    input_cost = billed_input * (input_price / 1_000_000)
+    output_cost = output_tokens * (output_price / 1_000_000)
     return input_cost + output_cost
 
 
+# Messages made only of these words are greetings, thanks or sign-offs
+_SMALL_TALK_WORDS = frozenset({
+    "hi", "hey", "hello", "yo", "there", "athena",
+    "thanks", "thank", "you", "thx", "ty", "much", "so", "a", "lot",
+    "ok", "okay", "cool", "great", "nice", "awesome", "perfect",
+    "got", "it", "sounds", "good", "morning", "evening", "night",
+    "bye", "goodbye", "later", "see", "ya", "lol", "haha",
+})
+
+
+def classify_complexity(prompt: str) -> str:
+    """
+    "simple" for short small talk, else "complex".
+
+    Deliberately narrow: short questions like "what's my sister's name"
+    still need memory retrieval, so only messages made entirely of
+    greeting/acknowledgement words qualify.
+    """
+    if "?" in prompt or "```" in prompt:
+        return "complex"
+    words = re.findall(r"[a-z']+", prompt.lower())
+    if words and len(words) < 8 and all(w in _SMALL_TALK_WORDS for w in words):
+        return "simple"
+    return "complex"
+
+
+@functools.cache
+def _token_encoding():
+    """cl100k_base BPE, a close proxy for Claude's tokenizer (None if unavailable)."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"tiktoken unavailable, estimating tokens from words: {e}")
+        return None
+
+
 def count_tokens_approx(text: str) -> int:
-    """Approximate token count (~1.3 tokens per word)."""
+    """Approximate token count (tiktoken, else ~1.3 tokens per word)."""
+    encoding = _token_encoding()
+    if encoding is not None:
+        return len(encoding.encode_ordinary(text))
     return int(len(text.split()) * 1.3)
 
 
@@ -138,6 +225,13 @@ def process_voice_input() -> str:
     audio_data = audio_recorder_component(key="voice_recorder")
     
     if audio_data:
+        # The widget returns the same recording on every rerun until the
+        # user records again - transcribe (and answer) each recording once
+        audio_hash = hashlib.sha256(audio_data).hexdigest()
+        if audio_hash == st.session_state.last_audio_hash:
+            return ""
+        st.session_state.last_audio_hash = audio_hash
+        
         try:
             # Show processing message
             with st.spinner("Transcribing audio..."):
@@ -164,6 +258,28 @@ def process_voice_input() -> str:
     return ""
 
 
+def check_contradictions_in_background(prompt: str, conversation_id: str):
+    """
+    Run the contradiction check on a daemon thread.
+
+    It only needs the user's message, so its embedding, search and Claude
+    calls overlap response generation instead of running after it.
+    """
+    try:
+        insights = get_insights_engine()
+    except Exception as e:
+        logger.warning(f"Contradiction check failed: {e}")
+        return
+
+    def run():
+        try:
+            insights.check_for_contradictions(prompt, conversation_id)
+        except Exception as e:
+            logger.warning(f"Contradiction check failed: {e}")
+
+    threading.Thread(target=run, name="contradiction-check", daemon=True).start()
+
+
 def display_weekly_digest():
     """Display weekly digest if available and not viewed."""
     insights = get_insights_engine()
@@ -232,6 +348,9 @@ def main():
     
     init_session_state()
     
+    # Model load overlaps page render instead of blocking the first query
+    preload_embeddings()
+    
     # Check for weekly digest generation
     check_and_generate_digest()
     
@@ -400,67 +519,101 @@ def main():
             message_placeholder = st.empty()
             
             try:
-                # Step 1: Check if we should use Grok
-                grok_result = hybrid_query(prompt)
+                # Step 1: Start Grok in the background if the query needs
+                # real-time data, so it overlaps with memory retrieval
+                grok_future = submit_hybrid_query(prompt)
                 
-                if grok_result["use_grok"]:
-                    status_placeholder.info("🔍 Fetching real-time data from Grok...")
-                    grok_data = grok_result["grok_data"]
-                    st.session_state.grok_cost += grok_result["cost"]
-                else:
-                    grok_data = None
+                # Small talk skips memory search and goes to the fast model
+                simple = (
+                    str(st.secrets.get("FAST_MODEL_ROUTING", "true")).lower() == "true"
+                    and classify_complexity(prompt) == "simple"
+                )
                 
                 # Step 2: Retrieve relevant past conversations
-                status_placeholder.info("🔍 Searching memories...")
+                if simple:
+                    retrieved_docs = []
+                else:
+                    status_placeholder.info("🔍 Searching memories...")
+                    
+                    try:
+                        retrieved_docs = hybrid_retrieve(
+                            query=prompt,
+                            conversation_id=st.session_state.conversation_id,
+                            turn_number=st.session_state.turn_number
+                        )
+                    except Exception as e:
+                        logger.warning(f"Retrieval failed: {e}")
+                        retrieved_docs = []
+                    
+                    # The query embedding is cached by now, so the contradiction
+                    # check starts without encoding the prompt a second time
+                    check_contradictions_in_background(
+                        prompt,
+                        st.session_state.conversation_id
+                    )
                 
+                if not grok_future.done():
+                    status_placeholder.info("🔍 Fetching real-time data from Grok...")
+                # Real-time data is optional: a stalled or failed Grok call
+                # must not hold up the answer
                 try:
-                    retrieved_docs = hybrid_retrieve(
-                        query=prompt,
-                        conversation_id=st.session_state.conversation_id,
-                        turn_number=st.session_state.turn_number
+                    grok_result = grok_future.result(
+                        timeout=float(st.secrets.get("GROK_WAIT_SECONDS", "30"))
                     )
                 except Exception as e:
-                    logger.warning(f"Retrieval failed: {e}")
-                    retrieved_docs = []
+                    grok_future.cancel()
+                    logger.warning(f"Grok unavailable, answering without real-time data: {e!r}")
+                    grok_result = {"use_grok": False}
+                
+                if grok_result["use_grok"]:
+                    grok_data = grok_result["grok_data"]
+                    st.session_state.grok_cost += grok_result["cost"]
+                else:
+                    grok_data = None
                 
                 # Format memories
                 retrieved_memories = format_retrieved_memories(retrieved_docs)
                 
-                # Step 3: Build system prompt with context
-                system_prompt = f"""You are Athena, a helpful AI assistant with perfect memory of all past conversations.
-
-{retrieved_memories}"""
+                # Step 3: Build the per-turn context block
+                context = retrieved_memories
                 
                 if grok_data:
-                    system_prompt += f"""
+                    context += f"""
 
 === REAL-TIME DATA (from Grok) ===
 {grok_data}
 
 Use this current data to provide up-to-date information, combined with historical context from memories."""
                 
-                system_prompt += """
-
-Use the above information naturally when relevant. Don't mention the retrieval system or data sources.
-Be helpful, concise, and build on our conversation history."""
-                
                 # Step 4: Prepare recent messages for Claude
                 session_limit = int(st.secrets.get("SESSION_HISTORY_LIMIT", "10"))
                 history_limit = session_limit * 2
                 
-                recent_messages = []
-                for msg in st.session_state.messages[-history_limit:]:
-                    if msg == st.session_state.messages[-1]:
-                        continue
-                    recent_messages.append({
-                        'role': msg['role'],
-                        'content': msg['content']
-                    })
+                # The current turn is the last message; it is added below
+                recent_messages = [
+                    {'role': msg['role'], 'content': msg['content']}
+                    for msg in st.session_state.messages[-history_limit:-1]
+                ]
                 
-                # Add current user message
+                # Cache breakpoint after the history, which is the same next
+                # turn; the context changes every turn so it comes after it
+                if recent_messages:
+                    recent_messages[-1] = {
+                        'role': recent_messages[-1]['role'],
+                        'content': [{
+                            'type': 'text',
+                            'text': recent_messages[-1]['content'],
+                            'cache_control': {'type': 'ephemeral'}
+                        }]
+                    }
+                
+                # Add current user message, led by the context block
                 recent_messages.append({
                     'role': 'user',
-                    'content': prompt
+                    'content': [
+                        {'type': 'text', 'text': context},
+                        {'type': 'text', 'text': prompt}
+                    ]
                 })
                 
                 # Step 5: Stream response from Claude
@@ -473,14 +626,25 @@ Be helpful, concise, and build on our conversation history."""
                 status_placeholder.success(status_msg)
                 
                 full_response = ""
+                # Filled with the API's token counts when the stream completes
+                usage = {}
+                # Re-render at most every 50ms: each markdown() call resends
+                # and re-parses the whole response in the browser
+                last_render = 0.0
                 claude_client = get_claude_client()
+                model = claude_client.fast_model if simple else claude_client.model
                 
                 for chunk in claude_client.chat_stream(
                     messages=recent_messages,
-                    system_prompt=system_prompt
+                    system_prompt=SYSTEM_PROMPT,
+                    model=model,
+                    usage=usage
                 ):
                     full_response += chunk
-                    message_placeholder.markdown(full_response + "▌")
+                    now = time.monotonic()
+                    if now - last_render >= 0.05:
+                        message_placeholder.markdown(full_response + "▌")
+                        last_render = now
                 
                 # Final response (remove cursor)
                 message_placeholder.markdown(full_response)
@@ -494,12 +658,20 @@ Be helpful, concise, and build on our conversation history."""
                     )
                 
                 # Step 7: Calculate tokens and cost
-                input_tokens = count_tokens_approx(prompt + retrieved_memories)
-                if grok_data:
-                    input_tokens += count_tokens_approx(grok_data)
-                output_tokens = count_tokens_approx(full_response)
-                total_tokens = input_tokens + output_tokens
-                cost = estimate_cost(input_tokens, output_tokens)
+                if usage:
+                    input_tokens = usage["input_tokens"]
+                    output_tokens = usage["output_tokens"]
+                    cache_write = usage["cache_creation_input_tokens"]
+                    cache_read = usage["cache_read_input_tokens"]
+                else:
+                    # No usage reported; estimate from the text instead
+                    input_tokens = count_tokens_approx(prompt) + count_tokens_approx(retrieved_memories)
+                    if grok_data:
+                        input_tokens += count_tokens_approx(grok_data)
+                    output_tokens = count_tokens_approx(full_response)
+                    cache_write = cache_read = 0
+                total_tokens = input_tokens + cache_write + cache_read + output_tokens
+                cost = estimate_cost(input_tokens, output_tokens, model, cache_write, cache_read)
                 
                 # Update session totals
                 st.session_state.total_tokens += total_tokens
@@ -511,16 +683,6 @@ Be helpful, concise, and build on our conversation history."""
                     "content": full_response
                 })
                 
-                # Step 9: Check for contradictions (async, doesn't block)
-                try:
-                    insights = get_insights_engine()
-                    insights.check_for_contradictions(
-                        prompt,
-                        st.session_state.conversation_id
-                    )
-                except Exception as e:
-                    logger.warning(f"Contradiction check failed: {e}")
-                
             except Exception as e:
                 status_placeholder.error(f"Error: {str(e)}")
                 logger.error(f"Error generating response: {e}", exc_info=True)